@@ -1,3 +1,5 @@
+import re
+
 from django.contrib import admin
 from django.shortcuts import reverse
 from django.templatetags.static import static
@@ -7,6 +9,9 @@ from django.shortcuts import redirect
 from urllib.parse import unquote
 from django.conf import settings
 
+from .images import get_derivative_url
+from .search import search_products
+from .models import Banner
 from .models import Product
 from .models import ProductCategory
 from .models import Restaurant
@@ -15,6 +20,19 @@ from .models import Order
 from .models import OrderItem
 
 
+PHONENUMBER_SEARCH_RE = re.compile(r'^\+?\d[\d\s()-]*$')
+
+
+def render_picture(product, size, style):
+    image = product.image
+    return format_html(
+        '<picture><source srcset="{webp_src}" type="image/webp"/><img src="{src}" style="{style}"/></picture>',
+        webp_src=get_derivative_url(image.storage, image.name, product.image_derivatives_source, size, 'webp'),
+        src=get_derivative_url(image.storage, image.name, product.image_derivatives_source, size),
+        style=style,
+    )
+
+
 class RestaurantMenuItemInline(admin.TabularInline):
     model = RestaurantMenuItem
     extra = 0
@@ -52,8 +70,7 @@ class ProductAdmin(admin.ModelAdmin):
         'category',
     ]
     search_fields = [
-        # FIXME SQLite can not convert letter case for cyrillic words properly, so search will be buggy.
-        # Migration to PostgreSQL is necessary
+        # Search goes through ProductSearchDocument, see get_search_results
         'name',
         'category__name',
     ]
@@ -86,6 +103,11 @@ class ProductAdmin(admin.ModelAdmin):
         'get_image_preview',
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search_products(search_term, queryset), False
+
     class Media:
         css = {
             "all": (
@@ -96,14 +118,18 @@ class ProductAdmin(admin.ModelAdmin):
     def get_image_preview(self, obj):
         if not obj.image:
             return 'выберите картинку'
-        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+        return render_picture(obj, 'medium', 'max-height: 200px;')
     get_image_preview.short_description = 'превью'
 
     def get_image_list_preview(self, obj):
         if not obj.image or not obj.id:
             return 'нет картинки'
         edit_url = reverse('admin:foodcartapp_product_change', args=(obj.id,))
-        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=obj.image.url)
+        return format_html(
+            '<a href="{edit_url}">{picture}</a>',
+            edit_url=edit_url,
+            picture=render_picture(obj, 'small', 'max-height: 50px;'),
+        )
     get_image_list_preview.short_description = 'превью'
 
 
@@ -112,6 +138,38 @@ class ProductAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = [
+        'get_image_list_preview',
+        'title',
+        'order',
+        'is_active',
+        'active_from',
+        'active_until',
+    ]
+    list_display_links = [
+        'title',
+    ]
+    list_editable = [
+        'order',
+        'is_active',
+    ]
+    list_filter = [
+        'is_active',
+    ]
+    search_fields = [
+        'title',
+        'text',
+    ]
+
+    def get_image_list_preview(self, obj):
+        if not obj.image:
+            return 'нет картинки'
+        return format_html('<img src="{src}" style="max-height: 50px;"/>', src=obj.image.url)
+    get_image_list_preview.short_description = 'превью'
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     raw_id_fields = ['product']
@@ -122,16 +180,26 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = [
         'id', 'first_name', 'last_name', 'phonenumber', 'address', 'cooking_restaurant',
-        'status', 'created_at', 'payment_method'
+        'status', 'total_price', 'created_at', 'payment_method'
     ]
-    search_fields = ['first_name', 'last_name', 'phonenumber']
+    search_fields = ['first_name', 'last_name']
     fields = [
         'first_name', 'last_name', 'phonenumber', 'address', 'status', 'payment_method', 'cooking_restaurant',
-        'comment', 'created_at', 'called_at', 'delivered_at',
+        'comment', 'total_price', 'created_at', 'called_at', 'delivered_at',
     ]
-    readonly_fields = ['created_at']
+    readonly_fields = ['total_price', 'created_at']
     inlines = [OrderItemInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if PHONENUMBER_SEARCH_RE.match(search_term):
+            return queryset.filter_by_phonenumber_prefix(re.sub(r'\D', '', search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).refresh_total_price()
+
     def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
         extra_context = extra_context or {}
         extra_context['next'] = request.GET.get('next')
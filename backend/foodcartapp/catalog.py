@@ -0,0 +1,301 @@
+from django.core.cache import cache
+
+from .images import get_derivative_url
+from .models import Banner, Product, Restaurant, RestaurantMenuItem
+from .renderers import dumps, iter_json_array
+from .search import search_products
+from .snapshots import VersionedSnapshot, VersionedValue, make_snapshot, make_version
+
+
+PRODUCT_COLUMNS = [
+    'id',
+    'name',
+    'price',
+    'special_status',
+    'description',
+    'category_id',
+    'category__name',
+    'image',
+    'image_derivatives_source',
+]
+
+PRODUCT_FIELD_COLUMNS = {
+    'id': ['id'],
+    'name': ['name'],
+    'price': ['price'],
+    'special_status': ['special_status'],
+    'description': ['description'],
+    'category': ['category_id', 'category__name'],
+    'image': ['image', 'image_derivatives_source'],
+    'image_webp': ['image', 'image_derivatives_source'],
+}
+
+
+def iter_products(products=None):
+    if products is None:
+        products = Product.objects.available()
+    storage = Product._meta.get_field('image').storage
+    rows = (
+        products
+        .order_by('id')
+        .values_list(*PRODUCT_COLUMNS)
+        .iterator()
+    )
+    for (id, name, price, special_status, description,
+         category_id, category_name, image, derivatives_source) in rows:
+        yield {
+            'id': id,
+            'name': name,
+            'price': price,
+            'special_status': special_status,
+            'description': description,
+            'category': {
+                'id': category_id,
+                'name': category_name,
+            } if category_id else None,
+            'image': get_derivative_url(storage, image, derivatives_source, 'medium'),
+            'image_webp': get_derivative_url(storage, image, derivatives_source, 'medium', 'webp'),
+        }
+
+
+def dump_products():
+    products = (
+        dict(product, restaurant={
+            'id': product['id'],
+            'name': product['name'],
+        })
+        for product in iter_products()
+    )
+    return b''.join(iter_json_array(products))
+
+
+def dump_product_row(row, fields, storage):
+    dumped_product = {}
+    for field in fields:
+        if field == 'category':
+            dumped_product['category'] = {
+                'id': row['category_id'],
+                'name': row['category__name'],
+            } if row['category_id'] else None
+        elif field == 'image':
+            dumped_product['image'] = get_derivative_url(
+                storage, row['image'], row['image_derivatives_source'], 'medium',
+            )
+        elif field == 'image_webp':
+            dumped_product['image_webp'] = get_derivative_url(
+                storage, row['image'], row['image_derivatives_source'], 'medium', 'webp',
+            )
+        else:
+            dumped_product[field] = row[field]
+    return dumped_product
+
+
+def dump_products_page(fields, limit, cursor=None, category=None, special_status=None):
+    """Return one page of the catalog ordered by id.
+
+    Only the columns behind the requested fields are selected, and the next
+    page starts right after the last id of this one.
+    """
+    columns = {'id'}
+    for field in fields:
+        columns.update(PRODUCT_FIELD_COLUMNS[field])
+
+    products = Product.objects.available().order_by('id')
+    if cursor is not None:
+        products = products.filter(id__gt=cursor)
+    if category is not None:
+        products = products.filter(category_id=category)
+    if special_status is not None:
+        products = products.filter(special_status=special_status)
+
+    rows = list(products.values(*columns)[:limit + 1])
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+
+    storage = Product._meta.get_field('image').storage
+    return dumps({
+        'next_cursor': next_cursor,
+        'results': [dump_product_row(row, fields, storage) for row in rows[:limit]],
+    })
+
+
+def dump_found_products(query, limit):
+    fields = list(PRODUCT_FIELD_COLUMNS)
+    columns = {column for field in fields for column in PRODUCT_FIELD_COLUMNS[field]}
+    rows = (
+        search_products(query, Product.objects.available())
+        .order_by('id')
+        .values(*columns)[:limit]
+    )
+    storage = Product._meta.get_field('image').storage
+    return dumps([dump_product_row(row, fields, storage) for row in rows])
+
+
+catalog_snapshot = VersionedSnapshot('catalog', dump_products)
+
+
+def dump_banners():
+    image_url = Banner._meta.get_field('image').storage.url
+    banners = Banner.objects.active().values_list('title', 'image', 'text')
+    return dumps([
+        {
+            'title': title,
+            'src': image_url(image),
+            'text': text,
+        }
+        for title, image, text in banners
+    ])
+
+
+banners_snapshot = VersionedSnapshot(
+    'banners',
+    dump_banners,
+    get_expires_at=Banner.objects.get_next_change_time,
+)
+
+
+class MenuMatrix(VersionedValue):
+    """Restaurant × product availability, prerendered per restaurant.
+
+    Answering a menu request is a dict lookup, the join over
+    RestaurantMenuItem runs only when a menu changes. Besides the version of
+    the whole matrix every restaurant row has its own version in the cache,
+    so an availability change rebuilds just the rows of its restaurants.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._row_versions = {}
+
+    def get_row_version_key(self, restaurant_id):
+        return f'{self.version_key}:{restaurant_id}'
+
+    def make_value(self, version, expires_at):
+        restaurant_ids = list(Restaurant.objects.values_list('id', flat=True))
+        # read before the menus, so a change made meanwhile is picked up later
+        row_version_keys = {self.get_row_version_key(restaurant_id): restaurant_id for restaurant_id in restaurant_ids}
+        self._row_versions = {
+            row_version_keys[key]: row_version
+            for key, row_version in cache.get_many(row_version_keys).items()
+        }
+
+        products = {product['id']: product for product in iter_products()}
+        menus = {restaurant_id: [] for restaurant_id in restaurant_ids}
+        menu_items = (
+            RestaurantMenuItem.objects
+            .filter(availability=True)
+            .order_by('product_id')
+            .values_list('restaurant_id', 'product_id')
+        )
+        for restaurant_id, product_id in menu_items:
+            if product_id in products and restaurant_id in menus:
+                menus[restaurant_id].append(products[product_id])
+        return {
+            restaurant_id: make_snapshot(
+                max(version, self._row_versions.get(restaurant_id, 0)),
+                dumps(restaurant_products),
+            )
+            for restaurant_id, restaurant_products in menus.items()
+        }
+
+    def get_menu(self, restaurant_id):
+        menus = self.get()
+        if restaurant_id not in menus:
+            return None
+        row_version = cache.get(self.get_row_version_key(restaurant_id))
+        if row_version == self._row_versions.get(restaurant_id):
+            return menus[restaurant_id]
+
+        with self._lock:
+            if restaurant_id in self._value and row_version != self._row_versions.get(restaurant_id):
+                restaurant_products = Product.objects.filter(
+                    menu_items__restaurant_id=restaurant_id,
+                    menu_items__availability=True,
+                )
+                self._value[restaurant_id] = make_snapshot(
+                    max(self._value_version, row_version or 0),
+                    dumps(list(iter_products(restaurant_products))),
+                )
+                self._row_versions[restaurant_id] = row_version
+            return self._value.get(restaurant_id)
+
+    def invalidate_rows(self, restaurant_ids):
+        version = self.get_version()
+        for restaurant_id in restaurant_ids:
+            key = self.get_row_version_key(restaurant_id)
+            cache.set(key, make_version(max(version, cache.get(key) or 0)), timeout=None)
+
+
+menu_matrix = MenuMatrix('menu')
+
+
+class ProductRestaurantsIndex:
+    """Restaurants that can cook a product, as a bitset per product.
+
+    Bit N stands for restaurants[N], so the restaurants that can cook a
+    whole order are the AND of the bitsets of its products.
+    """
+
+    def __init__(self, restaurants, product_masks):
+        self.restaurants = restaurants
+        self.product_masks = product_masks
+
+    def get_mask(self, product_ids):
+        mask = 0
+        for number, product_id in enumerate(product_ids):
+            product_mask = self.product_masks.get(product_id, 0)
+            mask = product_mask if number == 0 else mask & product_mask
+            if not mask:
+                break
+        return mask
+
+    def get_restaurants(self, product_ids):
+        restaurants = []
+        mask = self.get_mask(product_ids)
+        while mask:
+            lowest_bit = mask & -mask
+            restaurants.append(self.restaurants[lowest_bit.bit_length() - 1])
+            mask ^= lowest_bit
+        return restaurants
+
+
+def build_product_restaurants_index():
+    # the bits come from the same rows as the masks: a restaurant whose
+    # menu changes between two queries would otherwise have no bit
+    menu_items = list(
+        RestaurantMenuItem.objects
+        .filter(availability=True)
+        .values_list('restaurant_id', 'product_id')
+    )
+    restaurants_by_id = Restaurant.objects.in_bulk({restaurant_id for restaurant_id, _ in menu_items})
+    restaurants = [restaurants_by_id[restaurant_id] for restaurant_id in sorted(restaurants_by_id)]
+    restaurant_bits = {restaurant.id: 1 << number for number, restaurant in enumerate(restaurants)}
+    product_masks = {}
+    for restaurant_id, product_id in menu_items:
+        # the restaurant may have been deleted after the menu query
+        restaurant_bit = restaurant_bits.get(restaurant_id, 0)
+        product_masks[product_id] = product_masks.get(product_id, 0) | restaurant_bit
+    return ProductRestaurantsIndex(restaurants, product_masks)
+
+
+product_restaurants_index = VersionedValue(
+    'product_restaurants',
+    build=build_product_restaurants_index,
+)
+
+
+def invalidate_menus():
+    menu_matrix.invalidate()
+    product_restaurants_index.invalidate()
+
+
+def invalidate_menu_items(restaurant_ids):
+    # product availability changes with the menus, but the menu matrix
+    # only needs the rows of these restaurants
+    catalog_snapshot.invalidate()
+    product_restaurants_index.invalidate()
+    menu_matrix.invalidate_rows(restaurant_ids)
+
+
+def invalidate_catalog():
+    catalog_snapshot.invalidate()
+    invalidate_menus()
@@ -0,0 +1,62 @@
+"""Geocoding of order addresses outside the request.
+
+Addresses are handed to a small thread pool once the order is committed, so
+coordinates are usually in `Place` before a manager opens the dashboard.
+The pool has a bounded backlog: when it is full the address is skipped and
+is submitted again when the dashboard shows the order. Addresses the
+geocoder could not find are kept in `Place` without coordinates and are not
+looked up again for GEOCODER_RETRY_INTERVAL seconds.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from backend.places.models import Place
+from .utils import fetch_coordinates
+
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.GEOCODER_WORKERS,
+    thread_name_prefix='geocoder',
+)
+backlog = threading.BoundedSemaphore(settings.GEOCODER_MAX_BACKLOG)
+addresses_in_work = set()
+addresses_lock = threading.Lock()
+
+
+def geocode_address(address):
+    close_old_connections()
+    try:
+        if not Place.objects.filter(address=address, latitude__isnull=False, longitude__isnull=False).exists():
+            fetch_coordinates(address)
+    except Exception:
+        logger.exception('Не удалось определить координаты адреса %s', address)
+    finally:
+        with addresses_lock:
+            addresses_in_work.discard(address)
+        backlog.release()
+        close_old_connections()
+
+
+def submit_addresses(addresses):
+    for address in addresses:
+        with addresses_lock:
+            if address in addresses_in_work:
+                continue
+            if not backlog.acquire(blocking=False):
+                logger.warning('Очередь геокодера переполнена, адрес %s пропущен', address)
+                return
+            addresses_in_work.add(address)
+        executor.submit(geocode_address, address)
+
+
+def geocode_after_commit(addresses):
+    if not settings.YANDEX_GEOCODER_API_KEY:
+        return
+    addresses = list(dict.fromkeys(address for address in addresses if address))
+    transaction.on_commit(lambda: submit_addresses(addresses))
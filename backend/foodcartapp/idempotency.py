@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+import orjson
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .renderers import dumps
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class LocalTTLCache:
+    """Small LRU cache with expiry, private to one worker process."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+stored_responses = LocalTTLCache(
+    maxsize=settings.IDEMPOTENCY_CACHE_SIZE,
+    ttl=settings.IDEMPOTENCY_KEY_TTL,
+)
+
+
+def get_request_hash(request):
+    try:
+        body = orjson.dumps(request.data, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        # orjson takes integers up to 64 bits only
+        body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+def replay(stored_response, request_hash):
+    stored_hash, response_status, response_body = stored_response
+    if stored_hash != request_hash:
+        return Response(
+            {'detail': f'{IDEMPOTENCY_HEADER} уже использован с другим запросом'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if response_status is None:
+        return Response(
+            {'detail': 'Запрос с этим ключом ещё обрабатывается'},
+            status=status.HTTP_409_CONFLICT,
+        )
+    return Response(
+        orjson.loads(response_body),
+        status=response_status,
+        headers={'Idempotent-Replayed': 'true'},
+    )
+
+
+def claim_key(key, request_hash):
+    """Insert the key, or return the response stored for it.
+
+    A concurrent request with the same key blocks on the unique index until
+    the first one commits, and then reads its stored response.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+            return None
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(key=key).first()
+            if record is None:
+                continue
+            if record.created_at < now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL):
+                record.delete()
+                continue
+            return record.request_hash, record.response_status, record.response_body
+    return request_hash, None, ''
+
+
+def idempotent(view):
+    """Replay the stored response for a repeated Idempotency-Key header.
+
+    Goes between @api_view and the view function. Only responses of views
+    that finish without an exception are stored.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'{IDEMPOTENCY_HEADER} длиннее {MAX_KEY_LENGTH} символов'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        request_hash = get_request_hash(request)
+        stored_response = stored_responses.get(key)
+        if stored_response:
+            return replay(stored_response, request_hash)
+
+        with transaction.atomic():
+            stored_response = claim_key(key, request_hash)
+            if stored_response:
+                return replay(stored_response, request_hash)
+
+            response = view(request, *args, **kwargs)
+            stored_response = (request_hash, response.status_code, dumps(response.data).decode())
+            IdempotencyKey.objects.filter(key=key).update(
+                response_status=response.status_code,
+                response_body=stored_response[2],
+            )
+        transaction.on_commit(lambda: stored_responses.set(key, stored_response))
+        return response
+    return wrapper
+
+
+def purge_expired_keys():
+    expired_before = now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted_count, _ = IdempotencyKey.objects.filter(created_at__lt=expired_before).delete()
+    return deleted_count
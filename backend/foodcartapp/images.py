@@ -0,0 +1,69 @@
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+
+DERIVATIVES_DIR = 'derivatives'
+
+DERIVATIVE_SIZES = {
+    'small': 100,
+    'medium': 400,
+}
+
+DERIVATIVE_FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+}
+
+DERIVATIVE_QUALITY = 85
+
+
+def get_derivative_name(image_name, size, image_format='jpeg'):
+    # the source extension stays in the name, so burger.png and burger.jpg
+    # do not overwrite each other's copies
+    stem, source_extension = os.path.splitext(image_name)
+    _, extension = DERIVATIVE_FORMATS[image_format]
+    return f'{DERIVATIVES_DIR}/{stem}_{source_extension.lstrip(".")}_{size}.{extension}'
+
+
+def get_derivative_url(storage, image_name, derivatives_source, size, image_format='jpeg'):
+    """Return the URL of a resized copy, or of the original until copies are made.
+
+    `derivatives_source` is the image name the copies were last made for,
+    see Product.image_derivatives_source, so storage is never asked.
+    """
+    if image_name and image_name == derivatives_source:
+        return storage.url(get_derivative_name(image_name, size, image_format))
+    return storage.url(image_name)
+
+
+def make_derivatives(image, overwrite=True):
+    """Save every size and format of the image next to the original upload.
+
+    Returns the number of files written.
+    """
+    storage = image.storage
+    with storage.open(image.name, 'rb') as image_file:
+        original = Image.open(image_file)
+        original.load()
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+
+    written_count = 0
+    for size, max_side in DERIVATIVE_SIZES.items():
+        resized = original.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        for image_format, (pillow_format, _) in DERIVATIVE_FORMATS.items():
+            derivative_name = get_derivative_name(image.name, size, image_format)
+            if storage.exists(derivative_name):
+                if not overwrite:
+                    continue
+                storage.delete(derivative_name)
+
+            buffer = io.BytesIO()
+            resized.save(buffer, format=pillow_format, quality=DERIVATIVE_QUALITY)
+            storage.save(derivative_name, ContentFile(buffer.getvalue()))
+            written_count += 1
+    return written_count
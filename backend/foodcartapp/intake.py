@@ -0,0 +1,309 @@
+"""Durable local queue for orders accepted in asynchronous intake mode.
+
+Every accepted order is a JSON file `pending/<intake id>.json`, written with
+fsync and an atomic rename; intake ids start with the enqueue time, so file
+names sort in arrival order. A drain worker holds an flock on
+`processing/<worker id>.lock` while it lives and claims files by moving them
+to `processing/<worker id>/`. Files of a worker whose lock is free again are
+put back to `pending/`. Orders carry their intake id in the database, so a
+batch interrupted after commit is not inserted twice when it is drained
+again. Files that cannot be read or saved go to `failed/` with the error
+next to them.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Order, Product
+from .serializers import OrderSerializer, collect_product_ids
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+CREATED = 'created'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+
+def get_intake_dir(name):
+    path = os.path.join(settings.ORDER_INTAKE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_durably(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as tmp_file:
+        json.dump(data, tmp_file, ensure_ascii=False)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+    directory_fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+def make_intake_id():
+    # 20 digits of time and 12 random hex digits fit Order.intake_id
+    return f'{time.time_ns():020d}{uuid.uuid4().hex[:12]}'
+
+
+def enqueue_order(order_data):
+    intake_id = make_intake_id()
+    write_durably(
+        os.path.join(get_intake_dir('pending'), f'{intake_id}.json'),
+        {'id': intake_id, 'payload': order_data},
+    )
+    return intake_id
+
+
+def read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+
+
+def get_intake_status(intake_id):
+    file_name = f'{intake_id}.json'
+    result = read_json(os.path.join(get_intake_dir('results'), file_name))
+    if result:
+        return result
+
+    processing_dir = get_intake_dir('processing')
+    queue_paths = [
+        os.path.join(get_intake_dir('pending'), file_name),
+        *(
+            os.path.join(processing_dir, worker_id, file_name)
+            for worker_id in os.listdir(processing_dir)
+            if not worker_id.endswith('.lock')
+        ),
+    ]
+    if any(os.path.exists(path) for path in queue_paths):
+        return {'id': intake_id, 'status': QUEUED}
+    if os.path.exists(os.path.join(get_intake_dir('failed'), file_name)):
+        return {'id': intake_id, 'status': FAILED}
+
+    order_id = Order.objects.filter(intake_id=intake_id).values_list('id', flat=True).first()
+    if order_id:
+        return {'id': intake_id, 'status': CREATED, 'order_id': order_id}
+    return None
+
+
+def lock_worker(lock_path):
+    """Take the flock of a worker, return the descriptor or None if it is busy."""
+    lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        return None
+    if not os.fstat(lock_fd).st_nlink:
+        # the lock file was removed by whoever held it before us
+        os.close(lock_fd)
+        return None
+    return lock_fd
+
+
+def reclaim_abandoned_files():
+    """Put back to pending/ the files claimed by workers that are gone."""
+    processing_dir = get_intake_dir('processing')
+    pending_dir = get_intake_dir('pending')
+    for lock_name in os.listdir(processing_dir):
+        if not lock_name.endswith('.lock'):
+            continue
+        lock_path = os.path.join(processing_dir, lock_name)
+        lock_fd = lock_worker(lock_path)
+        if lock_fd is None:
+            continue  # the worker is alive
+        try:
+            claim_dir = os.path.join(processing_dir, lock_name[:-len('.lock')])
+            if os.path.isdir(claim_dir):
+                for file_name in os.listdir(claim_dir):
+                    if file_name.endswith('.json'):
+                        os.replace(os.path.join(claim_dir, file_name), os.path.join(pending_dir, file_name))
+                shutil.rmtree(claim_dir)
+            os.remove(lock_path)
+        finally:
+            os.close(lock_fd)
+
+
+@contextmanager
+def intake_worker():
+    """Yield the claim directory of this worker, held under its flock."""
+    processing_dir = get_intake_dir('processing')
+    lock_fd = None
+    while lock_fd is None:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        lock_path = os.path.join(processing_dir, f'{worker_id}.lock')
+        lock_fd = lock_worker(lock_path)
+    claim_dir = os.path.join(processing_dir, worker_id)
+    os.makedirs(claim_dir)
+    try:
+        yield claim_dir
+    finally:
+        try:
+            os.rmdir(claim_dir)
+            os.remove(lock_path)
+        except OSError:
+            pass  # files left behind are put back by the next reclaim
+        os.close(lock_fd)
+
+
+def claim_batch(claim_dir, batch_size):
+    """Move the oldest pending files to the claim directory, return their paths.
+
+    Files left in the directory by an interrupted batch come first.
+    """
+    paths = [
+        os.path.join(claim_dir, file_name)
+        for file_name in sorted(os.listdir(claim_dir))
+        if file_name.endswith('.json')
+    ][:batch_size]
+
+    pending_dir = get_intake_dir('pending')
+    for file_name in sorted(os.listdir(pending_dir)):
+        if len(paths) >= batch_size:
+            break
+        if not file_name.endswith('.json'):
+            continue
+        claimed_path = os.path.join(claim_dir, file_name)
+        try:
+            os.rename(os.path.join(pending_dir, file_name), claimed_path)
+        except FileNotFoundError:
+            continue  # claimed by another worker
+        paths.append(claimed_path)
+    return paths
+
+
+def move_to_failed(path, error):
+    failed_dir = get_intake_dir('failed')
+    file_name = os.path.basename(path)
+    write_durably(
+        os.path.join(failed_dir, f'{file_name[:-len(".json")]}.error'),
+        {'file': file_name, 'error': error},
+    )
+    os.replace(path, os.path.join(failed_dir, file_name))
+
+
+def read_entry(path):
+    try:
+        entry = read_json(path)
+        if not isinstance(entry, dict) or not isinstance(entry.get('id'), str) \
+                or not isinstance(entry.get('payload'), dict):
+            raise ValueError('ожидался объект с полями id и payload')
+    except ValueError as error:  # JSONDecodeError is a ValueError
+        move_to_failed(path, f'Не удалось прочитать файл: {error}')
+        return None
+    return entry
+
+
+def create_orders(valid_entries):
+    """Insert orders in one transaction, or one by one if the batch fails.
+
+    Returns {intake id: order id or error text}.
+    """
+    try:
+        with transaction.atomic():
+            orders = OrderSerializer(many=True).create([order_data for _, order_data in valid_entries])
+        return {intake_id: order.id for (intake_id, _), order in zip(valid_entries, orders)}
+    except Exception:
+        logger.exception('Не удалось сохранить пачку из %d заказов, сохраняем по одному', len(valid_entries))
+
+    outcomes = {}
+    for intake_id, order_data in valid_entries:
+        try:
+            with transaction.atomic():
+                outcomes[intake_id] = OrderSerializer(many=True).create([order_data])[0].id
+        except Exception as error:
+            # an order with this intake id may have been inserted meanwhile
+            order_id = Order.objects.filter(intake_id=intake_id).values_list('id', flat=True).first()
+            outcomes[intake_id] = order_id or f'Не удалось сохранить заказ: {error}'
+    return outcomes
+
+
+def drain_batch(claim_dir, batch_size):
+    """Insert one batch of queued orders, return the number of files handled."""
+    paths = claim_batch(claim_dir, batch_size)
+    if not paths:
+        return 0
+
+    entries = {}
+    for path in paths:
+        entry = read_entry(path)
+        if entry is None:
+            continue
+        if entry['id'] in entries:
+            move_to_failed(path, f'Повтор номера {entry["id"]}')
+            continue
+        entries[entry['id']] = (path, entry)
+
+    created_ids = dict(
+        Order.objects
+        .filter(intake_id__in=list(entries))
+        .values_list('intake_id', 'id')
+    )
+    new_entries = [entry for intake_id, (_, entry) in entries.items() if intake_id not in created_ids]
+    items = [
+        item
+        for entry in new_entries
+        if isinstance(entry['payload'].get('products'), list)
+        for item in entry['payload']['products']
+    ]
+    context = {'products': Product.objects.in_bulk(collect_product_ids(items))}
+
+    results = {
+        intake_id: {'id': intake_id, 'status': CREATED, 'order_id': order_id}
+        for intake_id, order_id in created_ids.items()
+    }
+    valid_entries = []
+    for entry in new_entries:
+        serializer = OrderSerializer(data=entry['payload'], context=context)
+        try:
+            is_valid = serializer.is_valid()
+        except Exception as error:
+            results[entry['id']] = {'id': entry['id'], 'status': FAILED, 'errors': f'Не удалось проверить заказ: {error}'}
+            continue
+        if is_valid:
+            valid_entries.append((entry['id'], {**serializer.validated_data, 'intake_id': entry['id']}))
+        else:
+            results[entry['id']] = {'id': entry['id'], 'status': REJECTED, 'errors': serializer.errors}
+
+    if valid_entries:
+        for intake_id, outcome in create_orders(valid_entries).items():
+            if isinstance(outcome, int):
+                results[intake_id] = {'id': intake_id, 'status': CREATED, 'order_id': outcome}
+            else:
+                results[intake_id] = {'id': intake_id, 'status': FAILED, 'errors': outcome}
+
+    results_dir = get_intake_dir('results')
+    for intake_id, result in results.items():
+        write_durably(os.path.join(results_dir, f'{intake_id}.json'), result)
+        path, _ = entries[intake_id]
+        if result['status'] == FAILED:
+            move_to_failed(path, result['errors'])
+        else:
+            os.remove(path)
+    return len(paths)
+
+
+def purge_results(max_age):
+    results_dir = get_intake_dir('results')
+    expired_before = time.time() - max_age
+    for file_name in os.listdir(results_dir):
+        path = os.path.join(results_dir, file_name)
+        if os.path.getmtime(path) < expired_before:
+            os.remove(path)
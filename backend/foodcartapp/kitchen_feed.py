@@ -0,0 +1,140 @@
+"""Server-Sent Events stream of orders for one restaurant kitchen.
+
+The stream starts with a snapshot of the active orders of the restaurant
+and then follows the OrderEvent outbox. Every message carries the outbox id,
+so a reconnecting EventSource resumes from its Last-Event-ID.
+
+A feed keeps a worker thread busy for up to KITCHEN_FEED_MAX_DURATION, so
+each worker process streams at most KITCHEN_FEED_MAX_CLIENTS feeds at once
+and leaves the rest of its threads to ordinary requests.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Min
+
+from .models import Order, OrderEvent
+from .renderers import dumps
+
+
+OUTBOX_BATCH_SIZE = 500
+
+
+def format_message(data, event, event_id):
+    return f'id: {event_id}\nevent: {event}\ndata: {dumps(data).decode()}\n\n'
+
+
+def dump_order(order):
+    return {
+        'id': order.id,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'address': order.address,
+        'comment': order.comment,
+        'created_at': order.created_at.isoformat(),
+        'items': [
+            {'product': item.product.name, 'quantity': item.quantity}
+            for item in order.items.all()
+        ],
+    }
+
+
+def get_orders(order_ids):
+    return (
+        Order.objects
+        .filter(pk__in=order_ids)
+        .prefetch_related('items__product')
+        .in_bulk()
+    )
+
+
+feed_slots = threading.BoundedSemaphore(max(settings.KITCHEN_FEED_MAX_CLIENTS, 1))
+
+
+def fetch_events(restaurant_id, after_id):
+    """Return the restaurant events after the id that are safe to send.
+
+    The second value is the id the client may resume from: past the events
+    of other restaurants, but not past an outbox gap that may still fill
+    in the next KITCHEN_FEED_GAP_TIMEOUT seconds.
+    """
+    settled_id = OrderEvent.objects.get_settled_id(after_id, settings.KITCHEN_FEED_GAP_TIMEOUT)
+    events = list(
+        OrderEvent.objects
+        .filter(restaurant_id=restaurant_id, id__gt=after_id, id__lte=settled_id)
+        .order_by('id')[:OUTBOX_BATCH_SIZE]
+    )
+    if len(events) == OUTBOX_BATCH_SIZE:
+        settled_id = events[-1].id
+    return events, settled_id
+
+
+def iter_kitchen_feed(restaurant_id, last_event_id=None):
+    started_at = time.monotonic()
+    yield f'retry: {settings.KITCHEN_FEED_RETRY_MS}\n\n'
+
+    first_id = OrderEvent.objects.aggregate(first_id=Min('id'))['first_id']
+    if last_event_id is not None and first_id and last_event_id < first_id - 1:
+        last_event_id = None  # the events the client missed are purged already
+
+    if last_event_id is None:
+        # not the last id: an event below it may still commit after the
+        # snapshot is read, and then it must come with the polls
+        last_event_id = OrderEvent.objects.get_settled_id(0, settings.KITCHEN_FEED_GAP_TIMEOUT)
+        orders = (
+            Order.objects
+            .filter(cooking_restaurant_id=restaurant_id)
+            .exclude(status=Order.DONE)
+            .prefetch_related('items__product')
+            .order_by('id')
+        )
+        yield format_message([dump_order(order) for order in orders], 'snapshot', last_event_id)
+
+    last_sent_at = time.monotonic()
+    while time.monotonic() - started_at < settings.KITCHEN_FEED_MAX_DURATION:
+        events, settled_id = fetch_events(restaurant_id, last_event_id)
+        orders = get_orders({event.order_id for event in events}) if events else {}
+        for event in events:
+            data = {'kind': event.kind, 'status': event.status, 'order_id': event.order_id}
+            order = orders.get(event.order_id)
+            if order and event.kind != OrderEvent.UNASSIGNED:
+                data['order'] = dump_order(order)
+            yield format_message(data, 'order', event.id)
+            last_sent_at = time.monotonic()
+        last_event_id = settled_id
+
+        if len(events) == OUTBOX_BATCH_SIZE:
+            continue
+        if time.monotonic() - last_sent_at >= settings.KITCHEN_FEED_HEARTBEAT:
+            # a message without data moves the client's Last-Event-ID past
+            # events of other restaurants
+            yield f': ping\nid: {last_event_id}\n\n'
+            last_sent_at = time.monotonic()
+        time.sleep(settings.KITCHEN_FEED_POLL_INTERVAL)
+
+
+class KitchenFeed:
+    """Feed messages that give the worker slot back when the response closes."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.closed = False
+
+    def __iter__(self):
+        return self.messages
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.messages.close()
+        if settings.KITCHEN_FEED_MAX_CLIENTS:
+            feed_slots.release()
+
+
+def open_kitchen_feed(restaurant_id, last_event_id=None):
+    """Return the feed, or None when this worker streams enough feeds already."""
+    if settings.KITCHEN_FEED_MAX_CLIENTS and not feed_slots.acquire(blocking=False):
+        return None
+    return KitchenFeed(iter_kitchen_feed(restaurant_id, last_event_id))
@@ -0,0 +1,68 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+
+from foodcartapp.catalog import dump_products
+from foodcartapp.models import Product
+
+
+def dump_products_with_models():
+    """Catalog serialization as it was done before the values() encoder."""
+    products = Product.objects.select_related('category').available()
+
+    dumped_products = []
+    for product in products:
+        dumped_product = {
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+            'special_status': product.special_status,
+            'description': product.description,
+            'category': {
+                'id': product.category.id,
+                'name': product.category.name,
+            } if product.category else None,
+            'image': product.image.url,
+            'restaurant': {
+                'id': product.id,
+                'name': product.name,
+            }
+        }
+        dumped_products.append(dumped_product)
+    return JsonResponse(dumped_products, safe=False, json_dumps_params={
+        'ensure_ascii': False,
+        'indent': 4,
+    }).content
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает старую и новую сериализацию каталога товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        paths = [
+            ('models + JsonResponse', dump_products_with_models),
+            ('values() + orjson', dump_products),
+        ]
+        for title, dump in paths:
+            body = dump()
+
+            started_at = time.perf_counter()
+            for _ in range(options['repeat']):
+                dump()
+            elapsed = (time.perf_counter() - started_at) / options['repeat']
+
+            tracemalloc.start()
+            dump()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write(
+                f'{title}: {elapsed * 1000:.2f} мс на ответ, '
+                f'пик памяти {peak_memory / 1024:.1f} КБ, '
+                f'размер ответа {len(body) / 1024:.1f} КБ'
+            )
@@ -0,0 +1,98 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from geopy.distance import distance as geopy_distance
+
+from foodcartapp.distances import get_distance_km, get_distance_matrix_km
+from foodcartapp.spatial import SpatialIndex
+
+
+def get_nearest_with_geopy(order_coords, restaurant_coords, limit):
+    """Nearest restaurants as view_orders found them, geopy for every pair."""
+    return [
+        sorted(
+            ((index, geopy_distance(order, restaurant).km) for index, restaurant in enumerate(restaurant_coords)),
+            key=lambda index_distance: index_distance[1],
+        )[:limit]
+        for order in order_coords
+    ]
+
+
+def get_nearest_with_lambert(order_coords, restaurant_coords, limit):
+    return [
+        sorted(
+            ((index, get_distance_km(order, restaurant)) for index, restaurant in enumerate(restaurant_coords)),
+            key=lambda index_distance: index_distance[1],
+        )[:limit]
+        for order in order_coords
+    ]
+
+
+def get_nearest_with_matrix(order_coords, restaurant_coords, limit):
+    distances = get_distance_matrix_km(order_coords, restaurant_coords)
+    nearest_indexes = distances.argsort(axis=1, kind='stable')[:, :limit]
+    return [
+        [(index, order_distances[index]) for index in order_indexes]
+        for order_distances, order_indexes in zip(distances.tolist(), nearest_indexes.tolist())
+    ]
+
+
+def get_nearest_with_index(order_coords, restaurant_coords, limit):
+    index = SpatialIndex(range(len(restaurant_coords)), restaurant_coords)
+    return [index.nearest(order, limit) for order in order_coords]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ближайших ресторанов через geopy, формулу Ламберта, матрицу NumPy и KD-дерево'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--restaurants', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=settings.DASHBOARD_NEAREST_RESTAURANTS)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        def make_coords(count):
+            # points spread over Moscow
+            return [(55.55 + rng.random() * 0.35, 37.35 + rng.random() * 0.5) for _ in range(count)]
+
+        order_coords = make_coords(options['orders'])
+        restaurant_coords = make_coords(options['restaurants'])
+        limit = options['limit'] or len(restaurant_coords)
+
+        paths = [
+            ('geopy по парам', get_nearest_with_geopy),
+            ('Ламберт по парам', get_nearest_with_lambert),
+            ('Ламберт матрицей NumPy', get_nearest_with_matrix),
+            ('KD-дерево и Ламберт', get_nearest_with_index),
+        ]
+        exact_nearest = None
+        for title, get_nearest in paths:
+            nearest = get_nearest(order_coords, restaurant_coords, limit)
+            if exact_nearest is None:
+                exact_nearest = nearest
+
+            started_at = time.perf_counter()
+            for _ in range(options['repeat']):
+                get_nearest(order_coords, restaurant_coords, limit)
+            elapsed = (time.perf_counter() - started_at) / options['repeat']
+
+            max_error = max(
+                abs(distance - exact_distance)
+                for order_nearest, order_exact in zip(nearest, exact_nearest)
+                for (_, distance), (_, exact_distance) in zip(order_nearest, order_exact)
+            ) * 1000
+            mismatches = sum(
+                [index for index, _ in order_nearest] != [index for index, _ in order_exact]
+                for order_nearest, order_exact in zip(nearest, exact_nearest)
+            )
+            self.stdout.write(
+                f'{title}: {elapsed * 1000:.2f} мс на {len(order_coords)} заказов и '
+                f'{len(restaurant_coords)} ресторанов, максимальное отклонение от geopy {max_error:.1f} м, '
+                f'другой порядок ресторанов у {mismatches} заказов'
+            )
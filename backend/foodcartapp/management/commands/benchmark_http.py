@@ -0,0 +1,405 @@
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from backend.places.models import Place
+from foodcartapp.catalog import invalidate_catalog
+from foodcartapp.models import (
+    Order,
+    OrderItem,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from foodcartapp.search import refresh_search_documents
+
+
+WARMUP_REQUESTS = 3
+MEMORY_REQUESTS = 5
+GUNICORN_START_TIMEOUT = 15
+
+MANAGER_USERNAME = 'benchmark-manager'
+MANAGER_PASSWORD = 'benchmark-password'
+
+
+def seed_database(restaurants_count, products_count, orders_count, rng):
+    """Fill an empty database with synthetic restaurants, menus and orders.
+
+    Every address gets a Place with coordinates, so the manager pages never
+    call the geocoder.
+    """
+    places = []
+
+    restaurants = []
+    for number in range(restaurants_count):
+        address = f'Москва, бенчмарк, ресторан {number}'
+        restaurants.append(Restaurant.objects.create(
+            name=f'Star Burger {number}',
+            address=address,
+            contact_phone=f'+7 900 000-{number:04d}',
+        ))
+        places.append(Place(
+            address=address,
+            latitude=55.55 + rng.random() * 0.35,
+            longitude=37.35 + rng.random() * 0.5,
+        ))
+
+    categories = [
+        ProductCategory.objects.create(name=name)
+        for name in ('Бургеры', 'Напитки', 'Десерты', 'Закуски')
+    ]
+    Product.objects.bulk_create([
+        Product(
+            name=f'Товар {number}',
+            category=rng.choice(categories),
+            price=Decimal(rng.randint(50, 900)),
+            image='benchmark.jpg',
+            special_status=rng.random() < 0.1,
+            description=f'Описание товара {number}',
+        )
+        for number in range(products_count)
+    ])
+    products = list(Product.objects.order_by('id'))
+    refresh_search_documents([product.id for product in products])
+
+    RestaurantMenuItem.objects.bulk_create([
+        RestaurantMenuItem(
+            restaurant=restaurant,
+            product=product,
+            availability=rng.random() < 0.9,
+        )
+        for restaurant in restaurants
+        for product in products
+        if rng.random() < 0.8
+    ])
+
+    addresses = [f'Москва, бенчмарк, дом {number}' for number in range(max(1, orders_count // 5))]
+    places.extend(
+        Place(
+            address=address,
+            latitude=55.55 + rng.random() * 0.35,
+            longitude=37.35 + rng.random() * 0.5,
+        )
+        for address in addresses
+    )
+    Place.objects.bulk_create(places)
+
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    with transaction.atomic():
+        for number in range(orders_count):
+            order = Order.objects.create(
+                first_name='Иван',
+                last_name=f'Бенчмарков {number}',
+                phonenumber=f'+7916{number:07d}',
+                address=rng.choice(addresses),
+                status=rng.choice(statuses),
+                payment_method=rng.choice([Order.CASH, Order.ELECTRONIC]),
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=product,
+                    quantity=rng.randint(1, 3),
+                    price=product.price,
+                )
+                for product in rng.sample(products, min(len(products), rng.randint(1, 5)))
+            ])
+        Order.objects.refresh_total_price()
+
+    get_user_model().objects.create_user(
+        MANAGER_USERNAME,
+        password=MANAGER_PASSWORD,
+        is_staff=True,
+    )
+    invalidate_catalog()
+    return [product.id for product in products]
+
+
+def make_order_payload(product_ids, rng, cart_size=None):
+    cart_size = cart_size or rng.randint(1, 5)
+    return {
+        'firstname': 'Пётр',
+        'lastname': 'Нагрузкин',
+        'phonenumber': '+79161234567',
+        'address': 'Москва, бенчмарк, дом 0',
+        'products': [
+            {'product': product_id, 'quantity': rng.randint(1, 3)}
+            for product_id in rng.sample(product_ids, min(len(product_ids), cart_size))
+        ],
+    }
+
+
+def summarize_latencies(latencies, elapsed):
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'latency_ms': {
+            'p50': round(percentiles[49] * 1000, 3),
+            'p90': round(percentiles[89] * 1000, 3),
+            'p95': round(percentiles[94] * 1000, 3),
+            'p99': round(percentiles[98] * 1000, 3),
+            'max': round(max(latencies) * 1000, 3),
+        },
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+def measure_with_client(client, send_request, repeat):
+    for _ in range(WARMUP_REQUESTS):
+        send_request(client)
+
+    latencies = []
+    query_counts = []
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            request_started_at = time.perf_counter()
+            response = send_request(client)
+            latencies.append(time.perf_counter() - request_started_at)
+        if response.status_code >= 400:
+            raise CommandError(f'{response.request["PATH_INFO"]} ответил {response.status_code}')
+        query_counts.append(len(queries))
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    for _ in range(MEMORY_REQUESTS):
+        send_request(client)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        **summarize_latencies(latencies, elapsed),
+        'errors': 0,
+        'sql_queries': {
+            'min': min(query_counts),
+            'max': max(query_counts),
+            'mean': round(statistics.mean(query_counts), 2),
+        },
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+def measure_with_http(base_url, method, path, make_payload, cookies, repeat, concurrency):
+    local = threading.local()
+
+    def send_request(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.cookies.update(cookies)
+        request_started_at = time.perf_counter()
+        response = local.session.request(method, base_url + path, json=make_payload() if make_payload else None)
+        return time.perf_counter() - request_started_at, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send_request, range(WARMUP_REQUESTS)))
+        started_at = time.perf_counter()
+        responses = list(executor.map(send_request, range(repeat)))
+        elapsed = time.perf_counter() - started_at
+
+    latencies = [latency for latency, _ in responses]
+    return {
+        **summarize_latencies(latencies, elapsed),
+        'errors': sum(1 for _, status_code in responses if status_code >= 400),
+        'sql_queries': None,
+        'peak_memory_kb': None,
+    }
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_database_url(settings_dict):
+    if settings_dict['ENGINE'] == 'django.db.backends.sqlite3':
+        return f'sqlite:///{os.path.abspath(settings_dict["NAME"])}'
+    return 'postgres://{USER}:{PASSWORD}@{HOST}:{PORT}/{NAME}'.format(**settings_dict)
+
+
+def start_gunicorn(port, workers, tmp_dir):
+    environment = {
+        **os.environ,
+        'DATABASE_URL': get_database_url(connection.settings_dict),
+        'DJANGO_DEBUG': '0',
+        'CACHE_LOCATION': os.path.join(tmp_dir, 'cache'),
+        'ORDER_THROTTLE_DIR': os.path.join(tmp_dir, 'throttle'),
+        # the benchmark sends every order from one address and phone number
+        'ORDER_THROTTLE_IP_RATE': '',
+        'ORDER_THROTTLE_PHONE_RATE': '',
+    }
+    log_path = os.path.join(tmp_dir, 'gunicorn.log')
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn', 'star_burger.wsgi:application',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers),
+            '--error-logfile', log_path,
+        ],
+        cwd=settings.BASE_DIR,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + GUNICORN_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f'gunicorn не запустился, см. {log_path}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise CommandError('gunicorn не начал принимать соединения')
+
+
+class Command(BaseCommand):
+    help = (
+        'Наполняет временную базу синтетическими данными и измеряет '
+        'задержки, пропускную способность, число SQL-запросов и память '
+        'для основных страниц и API. Результат выводится в JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=20)
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=100, help='Запросов на каждый сценарий')
+        parser.add_argument('--concurrency', type=int, default=4, help='Параллельных клиентов для gunicorn')
+        parser.add_argument('--workers', type=int, default=3, help='Воркеров gunicorn')
+        parser.add_argument('--no-gunicorn', action='store_true', help='Мерить только через тестовый клиент Django')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для JSON с результатами')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('Для перцентилей нужно хотя бы два запроса')
+        rng = random.Random(options['seed'])
+        tmp_dir = tempfile.mkdtemp(prefix='star_burger_benchmark_')
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'db.sqlite3')
+
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                DEBUG=False,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                ORDER_THROTTLE_RATES={},
+            ):
+                report = self.run_benchmarks(rng, tmp_dir, options)
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        dumped_report = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(dumped_report)
+        self.stdout.write(dumped_report)
+
+    def get_scenarios(self, product_ids, rng):
+        """Return (name, method, path, payload factory, needs manager login)."""
+        return [
+            ('GET /api/products/', 'GET', '/api/products/', None, False),
+            ('POST /api/order/', 'POST', '/api/order/', lambda: make_order_payload(product_ids, rng), False),
+            # Query counts of these two must match: products are loaded in one query
+            (
+                'POST /api/order/, 1 item',
+                'POST',
+                '/api/order/',
+                lambda: make_order_payload(product_ids, rng, cart_size=1),
+                False,
+            ),
+            (
+                'POST /api/order/, 20 items',
+                'POST',
+                '/api/order/',
+                lambda: make_order_payload(product_ids, rng, cart_size=20),
+                False,
+            ),
+            ('GET /manager/orders/', 'GET', '/manager/orders/', None, True),
+            ('GET /manager/products/', 'GET', '/manager/products/', None, True),
+        ]
+
+    def run_benchmarks(self, rng, tmp_dir, options):
+        seeding_started_at = time.perf_counter()
+        product_ids = seed_database(options['restaurants'], options['products'], options['orders'], rng)
+        report = {
+            'params': {
+                'restaurants': options['restaurants'],
+                'products': options['products'],
+                'orders': options['orders'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'workers': options['workers'],
+                'database': connection.vendor,
+                'seed': options['seed'],
+                'seeding_seconds': round(time.perf_counter() - seeding_started_at, 2),
+            },
+            'results': [],
+        }
+
+        client = Client()
+        manager_client = Client()
+        manager_client.login(username=MANAGER_USERNAME, password=MANAGER_PASSWORD)
+        scenarios = self.get_scenarios(product_ids, rng)
+
+        for name, method, path, make_payload, needs_login in scenarios:
+            def send_request(client, method=method, path=path, make_payload=make_payload):
+                if method == 'POST':
+                    return client.post(path, make_payload(), content_type='application/json')
+                return client.get(path)
+
+            report['results'].append({
+                'scenario': name,
+                'transport': 'django_test_client',
+                'requests': options['requests'],
+                **measure_with_client(manager_client if needs_login else client, send_request, options['requests']),
+            })
+
+        if options['no_gunicorn']:
+            return report
+
+        port = get_free_port()
+        process = start_gunicorn(port, options['workers'], tmp_dir)
+        try:
+            cookies = {settings.SESSION_COOKIE_NAME: manager_client.cookies[settings.SESSION_COOKIE_NAME].value}
+            for name, method, path, make_payload, needs_login in scenarios:
+                report['results'].append({
+                    'scenario': name,
+                    'transport': 'gunicorn',
+                    'requests': options['requests'],
+                    **measure_with_http(
+                        f'http://127.0.0.1:{port}',
+                        method,
+                        path,
+                        make_payload,
+                        cookies if needs_login else {},
+                        options['requests'],
+                        options['concurrency'],
+                    ),
+                })
+        finally:
+            process.terminate()
+            process.wait()
+        return report
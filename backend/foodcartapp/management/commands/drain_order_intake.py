@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from foodcartapp.intake import drain_batch, intake_worker, purge_results, reclaim_abandoned_files
+
+
+class Command(BaseCommand):
+    help = 'Переносит заказы из локальной очереди приёма в базу пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Не завершаться, а ждать новых заказов',
+        )
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между проверками очереди, сек')
+
+    def handle(self, *args, **options):
+        with intake_worker() as claim_dir:
+            while True:
+                reclaim_abandoned_files()
+                drained_count = 0
+                while True:
+                    batch_count = drain_batch(claim_dir, options['batch_size'])
+                    drained_count += batch_count
+                    if batch_count < options['batch_size']:
+                        break
+                if drained_count:
+                    self.stdout.write(f'Обработано заказов: {drained_count}')
+                purge_results(settings.ORDER_INTAKE_RESULT_TTL)
+
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.catalog import invalidate_catalog
+from foodcartapp.images import make_derivatives
+from foodcartapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии картинок товаров в JPEG и WebP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать уже существующие копии',
+        )
+
+    def handle(self, *args, **options):
+        products = list(Product.objects.exclude(image=''))
+
+        def process(product):
+            try:
+                return product, make_derivatives(product.image, overwrite=options['force']), None
+            except (OSError, ValueError) as error:
+                return product, 0, error
+
+        written_count = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for product, product_written_count, error in executor.map(process, products):
+                if error:
+                    self.stderr.write(f'{product.image.name}: {error}')
+                    continue
+                Product.objects.mark_image_derivatives(product.image.name)
+                written_count += product_written_count
+
+        invalidate_catalog()
+        self.stdout.write(f'Товаров: {len(products)}, создано файлов: {written_count}')
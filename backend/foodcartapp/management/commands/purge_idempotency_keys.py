@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Удаляет устаревшие ключи идемпотентности заказов'
+
+    def handle(self, *args, **options):
+        deleted_count = purge_expired_keys()
+        self.stdout.write(f'Удалено ключей: {deleted_count}')
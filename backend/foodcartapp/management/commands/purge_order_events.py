@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils.timezone import now
+
+from foodcartapp.models import OrderChange, OrderEvent
+
+
+class Command(BaseCommand):
+    help = 'Удаляет устаревшие события заказов, которые уже разосланы кухням, и старые записи версий заказов'
+
+    def handle(self, *args, **options):
+        expired_before = now() - timedelta(seconds=settings.ORDER_EVENTS_TTL)
+        deleted_count, _ = OrderEvent.objects.filter(created_at__lt=expired_before).delete()
+        self.stdout.write(f'Удалено событий: {deleted_count}')
+
+        # the last change is kept, it holds the current order version
+        last_change_id = OrderChange.objects.aggregate(last_id=Max('id'))['last_id']
+        deleted_count, _ = (
+            OrderChange.objects
+            .filter(created_at__lt=expired_before)
+            .exclude(id=last_change_id)
+            .delete()
+        )
+        self.stdout.write(f'Удалено изменений заказов: {deleted_count}')
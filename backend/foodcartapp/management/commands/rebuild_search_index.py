@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import Product
+from foodcartapp.search import refresh_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковый индекс товаров'
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        refresh_search_documents(product_ids)
+        self.stdout.write(f'Проиндексировано товаров: {len(product_ids)}')
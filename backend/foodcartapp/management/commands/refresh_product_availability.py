@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.catalog import invalidate_catalog
+from foodcartapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает, в скольких ресторанах продаётся каждый товар'
+
+    def handle(self, *args, **options):
+        updated_count = Product.objects.refresh_availability()
+        invalidate_catalog()
+        self.stdout.write(f'Пересчитано товаров: {updated_count}')
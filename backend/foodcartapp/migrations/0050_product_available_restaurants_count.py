@@ -0,0 +1,37 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_available_restaurants_count(apps, schema_editor):
+    Product = apps.get_model('foodcartapp', 'Product')
+    RestaurantMenuItem = apps.get_model('foodcartapp', 'RestaurantMenuItem')
+    available_items_count = (
+        RestaurantMenuItem.objects
+        .filter(product=OuterRef('pk'), availability=True)
+        .order_by()
+        .values('product')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    Product.objects.update(
+        available_restaurants_count=Coalesce(Subquery(available_items_count), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0049_alter_orderitem_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_restaurants_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='в продаже в ресторанах'),
+        ),
+        migrations.RunPython(fill_available_restaurants_count, reverse_code=migrations.RunPython.noop),
+    ]
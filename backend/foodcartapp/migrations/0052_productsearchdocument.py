@@ -0,0 +1,99 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQLITE_CREATE_FTS = [
+    """
+    CREATE VIRTUAL TABLE foodcartapp_productsearch_fts USING fts5(
+        text,
+        content='foodcartapp_productsearchdocument',
+        content_rowid='product_id',
+        tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER foodcartapp_productsearch_ai AFTER INSERT ON foodcartapp_productsearchdocument BEGIN
+        INSERT INTO foodcartapp_productsearch_fts(rowid, text) VALUES (new.product_id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER foodcartapp_productsearch_ad AFTER DELETE ON foodcartapp_productsearchdocument BEGIN
+        INSERT INTO foodcartapp_productsearch_fts(foodcartapp_productsearch_fts, rowid, text)
+        VALUES ('delete', old.product_id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER foodcartapp_productsearch_au AFTER UPDATE ON foodcartapp_productsearchdocument BEGIN
+        INSERT INTO foodcartapp_productsearch_fts(foodcartapp_productsearch_fts, rowid, text)
+        VALUES ('delete', old.product_id, old.text);
+        INSERT INTO foodcartapp_productsearch_fts(rowid, text) VALUES (new.product_id, new.text);
+    END
+    """,
+]
+
+SQLITE_DROP_FTS = [
+    'DROP TRIGGER IF EXISTS foodcartapp_productsearch_ai',
+    'DROP TRIGGER IF EXISTS foodcartapp_productsearch_ad',
+    'DROP TRIGGER IF EXISTS foodcartapp_productsearch_au',
+    'DROP TABLE IF EXISTS foodcartapp_productsearch_fts',
+]
+
+POSTGRESQL_CREATE_TRGM = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX foodcartapp_productsearch_trgm
+    ON foodcartapp_productsearchdocument USING gin (text gin_trgm_ops)
+    """,
+]
+
+POSTGRESQL_DROP_TRGM = [
+    'DROP INDEX IF EXISTS foodcartapp_productsearch_trgm',
+]
+
+
+def execute_for_vendor(statements_by_vendor):
+    def execute(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return execute
+
+
+def fill_search_documents(apps, schema_editor):
+    Product = apps.get_model('foodcartapp', 'Product')
+    ProductSearchDocument = apps.get_model('foodcartapp', 'ProductSearchDocument')
+    products = Product.objects.values_list('id', 'name', 'description', 'category__name')
+    ProductSearchDocument.objects.bulk_create([
+        ProductSearchDocument(
+            product_id=product_id,
+            text=' '.join(part for part in (name, category_name, description) if part).casefold(),
+        )
+        for product_id, name, description, category_name in products
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0051_banner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='foodcartapp.product', verbose_name='товар')),
+                ('text', models.TextField(verbose_name='текст для поиска')),
+            ],
+            options={
+                'verbose_name': 'поисковый документ товара',
+                'verbose_name_plural': 'поисковые документы товаров',
+            },
+        ),
+        migrations.RunPython(
+            execute_for_vendor({'sqlite': SQLITE_CREATE_FTS, 'postgresql': POSTGRESQL_CREATE_TRGM}),
+            reverse_code=execute_for_vendor({'sqlite': SQLITE_DROP_FTS, 'postgresql': POSTGRESQL_DROP_TRGM}),
+        ),
+        migrations.RunPython(fill_search_documents, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:34
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_total_price(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    OrderItem = apps.get_model('foodcartapp', 'OrderItem')
+    items_total_price = (
+        OrderItem.objects
+        .filter(order=OuterRef('pk'))
+        .order_by()
+        .values('order')
+        .annotate(total_price=Sum(F('quantity') * F('price'), output_field=DecimalField()))
+        .values('total_price')
+    )
+    Order.objects.update(
+        total_price=Coalesce(Subquery(items_total_price), Decimal('0.00'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0054_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10, verbose_name='сумма заказа'),
+        ),
+        migrations.RunPython(fill_total_price, reverse_code=migrations.RunPython.noop),
+    ]
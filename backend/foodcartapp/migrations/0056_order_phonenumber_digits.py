@@ -0,0 +1,34 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:38
+
+from django.db import migrations
+import foodcartapp.phones
+
+
+def fill_phonenumber_digits(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    orders = []
+    for order in Order.objects.only('id', 'phonenumber').iterator(chunk_size=2000):
+        order.phonenumber_digits = foodcartapp.phones.get_phonenumber_digits(order.phonenumber)
+        orders.append(order)
+    Order.objects.bulk_update(orders, ['phonenumber_digits'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0055_order_total_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='phonenumber_digits',
+            field=foodcartapp.phones.PhoneNumberDigitsField(blank=True, db_index=True, editable=False, max_length=15, source='phonenumber', verbose_name='цифры номера телефона'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='phonenumber',
+            field=foodcartapp.phones.CachedPhoneNumberField(db_index=True, max_length=128, region=None, verbose_name='номер телефона'),
+        ),
+        migrations.RunPython(fill_phonenumber_digits, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0056_order_phonenumber_digits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('assigned', 'Назначен ресторану'), ('updated', 'Изменён статус'), ('unassigned', 'Снят с ресторана')], max_length=20, verbose_name='событие')),
+                ('status', models.CharField(choices=[('new', 'Новый'), ('confirmed', 'Подтверждён'), ('cooking', 'Готовится'), ('delivering', 'Доставляется'), ('done', 'Выполнен')], max_length=20, verbose_name='статус заказа')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='время события')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='foodcartapp.order', verbose_name='заказ')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_events', to='foodcartapp.restaurant', verbose_name='ресторан')),
+            ],
+            options={
+                'verbose_name': 'событие заказа',
+                'verbose_name_plural': 'события заказов',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(fields=['restaurant', 'id'], name='order_event_restaurant_id_idx'),
+        ),
+    ]
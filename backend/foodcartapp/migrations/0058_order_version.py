@@ -0,0 +1,43 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:41
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_order_versions(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    OrderVersionCounter = apps.get_model('foodcartapp', 'OrderVersionCounter')
+    Order.objects.update(version=1, updated_at=F('created_at'))
+    OrderVersionCounter.objects.create(pk=1, value=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0057_orderevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderVersionCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='последняя версия')),
+            ],
+            options={
+                'verbose_name': 'счётчик версий заказов',
+                'verbose_name_plural': 'счётчики версий заказов',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='время изменения'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, verbose_name='версия'),
+        ),
+        migrations.RunPython(fill_order_versions, reverse_code=migrations.RunPython.noop),
+    ]
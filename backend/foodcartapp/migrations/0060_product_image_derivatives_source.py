@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0059_order_status_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_derivatives_source',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='картинка, для которой сделаны копии'),
+        ),
+    ]
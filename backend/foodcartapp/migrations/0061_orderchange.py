@@ -0,0 +1,42 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:21
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def continue_order_versions(apps, schema_editor):
+    OrderVersionCounter = apps.get_model('foodcartapp', 'OrderVersionCounter')
+    OrderChange = apps.get_model('foodcartapp', 'OrderChange')
+    last_version = OrderVersionCounter.objects.filter(pk=1).values_list('value', flat=True).first()
+    if not last_version:
+        return
+    OrderChange.objects.create(id=last_version)
+    connection = schema_editor.connection
+    for statement in connection.ops.sequence_reset_sql(no_style(), [OrderChange]):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0060_product_image_derivatives_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='время изменения')),
+            ],
+            options={
+                'verbose_name': 'изменение заказов',
+                'verbose_name_plural': 'изменения заказов',
+            },
+        ),
+        migrations.RunPython(continue_order_versions, reverse_code=migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='OrderVersionCounter',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0061_orderchange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'done'), _negated=True), fields=['-id'], name='order_unfinished_id_idx'),
+        ),
+    ]
@@ -1,10 +1,13 @@
-from django.db import models
-from django.db.models import Sum, DecimalField, F
+from django.db import models, router, transaction
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery, Sum, DecimalField, F
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from django.utils.timezone import now
-from phonenumber_field.modelfields import PhoneNumberField
+from datetime import timedelta
 from decimal import Decimal
 
+from .phones import CachedPhoneNumberField, PhoneNumberDigitsField
+
 
 class Restaurant(models.Model):
     name = models.CharField(
@@ -32,12 +35,24 @@ class Restaurant(models.Model):
 
 class ProductQuerySet(models.QuerySet):
     def available(self):
-        products = (
+        return self.filter(available_restaurants_count__gt=0)
+
+    def mark_image_derivatives(self, image_name):
+        # only products that still have this image, it may have been replaced meanwhile
+        return self.filter(image=image_name).update(image_derivatives_source=image_name)
+
+    def refresh_availability(self):
+        available_items_count = (
             RestaurantMenuItem.objects
-            .filter(availability=True)
-            .values_list('product')
+            .filter(product=OuterRef('pk'), availability=True)
+            .order_by()
+            .values('product')
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        return self.update(
+            available_restaurants_count=Coalesce(Subquery(available_items_count), 0)
         )
-        return self.filter(pk__in=products)
 
 
 class ProductCategory(models.Model):
@@ -76,6 +91,12 @@ class Product(models.Model):
     image = models.ImageField(
         'картинка'
     )
+    image_derivatives_source = models.CharField(
+        'картинка, для которой сделаны копии',
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
     special_status = models.BooleanField(
         'спец.предложение',
         default=False,
@@ -86,6 +107,14 @@ class Product(models.Model):
         max_length=200,
         blank=True,
     )
+    available_restaurants_count = models.PositiveIntegerField(
+        'в продаже в ресторанах',
+        default=0,
+        db_index=True,
+        editable=False,
+    )
+
+    COMPUTED_FIELDS = ('available_restaurants_count', 'image_derivatives_source')
 
     objects = ProductQuerySet.as_manager()
 
@@ -96,6 +125,85 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # these fields are written by background updates, a value loaded
+        # before one of them must not overwrite the fresh one
+        if update_fields is None and not self._state.adding and not force_insert:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COMPUTED_FIELDS
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class ProductSearchDocument(models.Model):
+    """Casefolded text of a product kept for the search index.
+
+    Python casefolding works for Cyrillic, unlike SQLite LOWER(). On SQLite
+    the table feeds an FTS5 index through triggers, on PostgreSQL it has a
+    trigram index, see migration 0052.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        verbose_name='товар',
+        related_name='search_document',
+        primary_key=True,
+        on_delete=models.CASCADE,
+    )
+    text = models.TextField('текст для поиска')
+
+    class Meta:
+        verbose_name = 'поисковый документ товара'
+        verbose_name_plural = 'поисковые документы товаров'
+
+    def __str__(self):
+        return str(self.product_id)
+
+
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    """Keeps Product.available_restaurants_count in sync on bulk writes.
+
+    Single objects are handled by signals, but update() and bulk_create()
+    bypass them.
+    """
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            old_rows = list(self.values_list('pk', 'product_id', 'restaurant_id'))
+            updated_count = super().update(**kwargs)
+            product_ids = {product_id for _, product_id, _ in old_rows}
+            restaurant_ids = {restaurant_id for _, _, restaurant_id in old_rows}
+            if {'product', 'product_id', 'restaurant', 'restaurant_id'} & kwargs.keys():
+                # the new value may be an expression, e.g. a Case() from
+                # bulk_update(), so read the rows back
+                new_rows = (
+                    RestaurantMenuItem.objects
+                    .using(self.db)
+                    .filter(pk__in=[pk for pk, _, _ in old_rows])
+                    .values_list('product_id', 'restaurant_id')
+                )
+                for product_id, restaurant_id in new_rows:
+                    product_ids.add(product_id)
+                    restaurant_ids.add(restaurant_id)
+            self._refresh_products(product_ids, restaurant_ids)
+        return updated_count
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            menu_items = super().bulk_create(objs, *args, **kwargs)
+            self._refresh_products(
+                {menu_item.product_id for menu_item in menu_items},
+                {menu_item.restaurant_id for menu_item in menu_items},
+            )
+        return menu_items
+
+    def _refresh_products(self, product_ids, restaurant_ids):
+        from .catalog import invalidate_menu_items
+
+        Product.objects.using(self.db).filter(pk__in=product_ids).refresh_availability()
+        transaction.on_commit(lambda: invalidate_menu_items(restaurant_ids), using=self.db)
+
 
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
@@ -116,6 +224,8 @@ class RestaurantMenuItem(models.Model):
         db_index=True
     )
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'пункт меню ресторана'
         verbose_name_plural = 'пункты меню ресторана'
@@ -127,13 +237,203 @@ class RestaurantMenuItem(models.Model):
         return f"{self.restaurant.name} - {self.product.name}"
 
 
+class BannerQuerySet(models.QuerySet):
+    def active(self, moment=None):
+        moment = moment or now()
+        return self.filter(
+            Q(active_from__isnull=True) | Q(active_from__lte=moment),
+            Q(active_until__isnull=True) | Q(active_until__gt=moment),
+            is_active=True,
+        )
+
+    def get_next_change_time(self, moment=None):
+        """Return the nearest moment when the set of active banners changes."""
+        moment = moment or now()
+        boundaries = [
+            self.filter(is_active=True, active_from__gt=moment).aggregate(
+                boundary=Min('active_from')
+            )['boundary'],
+            self.filter(is_active=True, active_until__gt=moment).aggregate(
+                boundary=Min('active_until')
+            )['boundary'],
+        ]
+        boundaries = [boundary for boundary in boundaries if boundary]
+        return min(boundaries) if boundaries else None
+
+
+class Banner(models.Model):
+    title = models.CharField(
+        'заголовок',
+        max_length=50,
+    )
+    image = models.ImageField(
+        'картинка',
+        upload_to='banners/',
+    )
+    text = models.CharField(
+        'текст',
+        max_length=200,
+        blank=True,
+    )
+    order = models.PositiveIntegerField(
+        'порядок',
+        default=0,
+        db_index=True,
+    )
+    is_active = models.BooleanField(
+        'показывать',
+        default=True,
+        db_index=True,
+    )
+    active_from = models.DateTimeField(
+        'показывать с',
+        null=True,
+        blank=True,
+    )
+    active_until = models.DateTimeField(
+        'показывать до',
+        null=True,
+        blank=True,
+    )
+
+    objects = BannerQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'баннер'
+        verbose_name_plural = 'баннеры'
+        ordering = ['order', 'id']
+
+    def __str__(self):
+        return self.title
+
+
+class OutboxQuerySet(models.QuerySet):
+    """Rows with increasing ids and a created_at, read in id order."""
+
+    def get_settled_id(self, after_id, gap_timeout):
+        """Return the id up to which no more rows can show up.
+
+        Ids are taken when a row is inserted, but transactions can commit out
+        of order, so a gap may be a row that is not visible yet. Only rows
+        younger than gap_timeout seconds are checked for a gap right before
+        them, older gaps are taken to be rolled back.
+        """
+        last_id = self.aggregate(last_id=Max('id'))['last_id'] or 0
+        if last_id <= after_id:
+            return after_id
+
+        gap_deadline = now() - timedelta(seconds=gap_timeout)
+        recent_ids = list(
+            self
+            .filter(id__gt=after_id, id__lte=last_id, created_at__gt=gap_deadline)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        previous_ids = {row_id - 1 for row_id in recent_ids if row_id - 1 > after_id}
+        previous_ids.difference_update(recent_ids)
+        if previous_ids:
+            previous_ids.difference_update(self.filter(id__in=previous_ids).values_list('id', flat=True))
+        for row_id in recent_ids:
+            if row_id - 1 in previous_ids:
+                # hold back the gap and everything after it
+                settled_id = self.filter(id__gt=after_id, id__lt=row_id).aggregate(settled_id=Max('id'))['settled_id']
+                return settled_id or after_id
+        return last_id
+
+
+class OrderChange(models.Model):
+    """Append-only log of order writes, its ids are the order versions.
+
+    Every write inserts a row instead of bumping one counter row, so
+    concurrent order writes don't queue on a single row lock. Versions of
+    transactions still in flight may commit late, readers take the settled
+    version from get_current().
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField(
+        'время изменения',
+        default=now,
+        db_index=True,
+    )
+
+    objects = OutboxQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'изменение заказов'
+        verbose_name_plural = 'изменения заказов'
+
+    def __str__(self):
+        return str(self.id)
+
+    @classmethod
+    def take_version(cls, using=None):
+        return cls.objects.using(using).create().id
+
+    @classmethod
+    def get_current(cls, gap_timeout, after_version=0, using=None):
+        """Return the version every order change up to which is visible."""
+        return cls.objects.using(using).get_settled_id(after_version, gap_timeout)
+
+
 class OrderQuerySet(models.QuerySet):
-    def with_total_price(self):
-        return self.annotate(
-            total_price=Sum(
-                F('items__quantity') * F('items__product__price'),
-                output_field=DecimalField()
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            version = OrderChange.take_version(self.db)
+            for order in objs:
+                order.version = version
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            kwargs = {**kwargs, 'version': OrderChange.take_version(self.db), 'updated_at': now()}
+            if not {'status', 'cooking_restaurant', 'cooking_restaurant_id'} & kwargs.keys():
+                return super().update(**kwargs)
+
+            # record kitchen feed events in the same transaction as the change
+            old_states = {
+                order_id: (status, restaurant_id)
+                for order_id, status, restaurant_id
+                in self.values_list('id', 'status', 'cooking_restaurant_id')
+            }
+            updated_count = super().update(**kwargs)
+            new_states = (
+                Order.objects
+                .using(self.db)
+                .filter(pk__in=old_states)
+                .values_list('id', 'status', 'cooking_restaurant_id')
             )
+            OrderEvent.objects.using(self.db).bulk_create([
+                event
+                for order_id, status, restaurant_id in new_states
+                for event in OrderEvent.make_events(order_id, old_states[order_id], (status, restaurant_id))
+            ])
+            return updated_count
+
+    def unfinished(self):
+        # the same condition as order_unfinished_id_idx, so the dashboard
+        # walks that partial index newest first
+        return self.exclude(status=Order.DONE)
+
+    def filter_by_phonenumber_prefix(self, digits):
+        # a range instead of LIKE 'digits%', so the plain index is used on every backend
+        return self.filter(
+            phonenumber_digits__gte=digits,
+            phonenumber_digits__lt=digits[:-1] + chr(ord(digits[-1]) + 1),
+        )
+
+    def refresh_total_price(self):
+        items_total_price = (
+            OrderItem.objects
+            .filter(order=OuterRef('pk'))
+            .order_by()
+            .values('order')
+            .annotate(total_price=Sum(F('quantity') * F('price'), output_field=DecimalField()))
+            .values('total_price')
+        )
+        return self.update(
+            total_price=Coalesce(Subquery(items_total_price), Decimal('0.00'))
         )
 
 
@@ -167,10 +467,15 @@ class Order(models.Model):
         'фамилия',
         max_length=20
     )
-    phonenumber = PhoneNumberField(
+    phonenumber = CachedPhoneNumberField(
         'номер телефона',
         db_index=True,
     )
+    phonenumber_digits = PhoneNumberDigitsField(
+        'цифры номера телефона',
+        source='phonenumber',
+        db_index=True,
+    )
     address = models.CharField(
         'адрес',
         max_length=100
@@ -218,15 +523,71 @@ class Order(models.Model):
         blank=True,
         db_index=True,
     )
+    total_price = models.DecimalField(
+        'сумма заказа',
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+    )
+    updated_at = models.DateTimeField(
+        'время изменения',
+        auto_now=True,
+        db_index=True,
+    )
+    version = models.PositiveBigIntegerField(
+        'версия',
+        default=0,
+        db_index=True,
+        editable=False,
+    )
+    intake_id = models.CharField(
+        'номер в очереди приёма',
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+    )
 
     objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return f'Заказ №{self.id} от {self.first_name} {self.last_name}'
 
+    @staticmethod
+    def get_items_total_price(items):
+        return sum((item['quantity'] * item['product'].price for item in items), Decimal('0.00'))
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(Order, instance=self)
+        # take the version and record kitchen feed events in the same
+        # transaction as the change
+        with transaction.atomic(using=using):
+            old_state = None
+            if self.pk:
+                old_state = (
+                    Order.objects
+                    .using(using)
+                    .filter(pk=self.pk)
+                    .values_list('status', 'cooking_restaurant_id')
+                    .first()
+                )
+            self.version = OrderChange.take_version(using)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+            super().save(*args, **kwargs)
+            OrderEvent.objects.using(using).bulk_create(
+                OrderEvent.make_events(self.pk, old_state, (self.status, self.cooking_restaurant_id))
+            )
+
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
+        indexes = [
+            models.Index(fields=['status', '-id'], name='order_status_id_idx'),
+            models.Index(fields=['-id'], name='order_unfinished_id_idx', condition=~Q(status='done')),
+        ]
 
 
 class OrderItem(models.Model):
@@ -249,3 +610,115 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = 'позиция заказа'
         verbose_name_plural = 'позиции заказа'
+
+
+class OrderEvent(models.Model):
+    """Outbox of order changes that matter to the restaurant kitchens.
+
+    Rows are written in the same transaction as the order change and are
+    streamed to kitchens in id order.
+    """
+    ASSIGNED = 'assigned'
+    UPDATED = 'updated'
+    UNASSIGNED = 'unassigned'
+
+    KIND_CHOICES = [
+        (ASSIGNED, 'Назначен ресторану'),
+        (UPDATED, 'Изменён статус'),
+        (UNASSIGNED, 'Снят с ресторана'),
+    ]
+
+    order = models.ForeignKey(
+        Order,
+        verbose_name='заказ',
+        related_name='events',
+        on_delete=models.CASCADE,
+    )
+    restaurant = models.ForeignKey(
+        Restaurant,
+        verbose_name='ресторан',
+        related_name='order_events',
+        on_delete=models.CASCADE,
+    )
+    kind = models.CharField(
+        'событие',
+        max_length=20,
+        choices=KIND_CHOICES,
+    )
+    status = models.CharField(
+        'статус заказа',
+        max_length=20,
+        choices=Order.STATUS_CHOICES,
+    )
+    created_at = models.DateTimeField(
+        'время события',
+        default=now,
+        db_index=True,
+    )
+
+    objects = OutboxQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'событие заказа'
+        verbose_name_plural = 'события заказов'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['restaurant', 'id'], name='order_event_restaurant_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: заказ {self.order_id}'
+
+    @staticmethod
+    def make_events(order_id, old_state, new_state):
+        old_status, old_restaurant_id = old_state or (None, None)
+        status, restaurant_id = new_state
+        events = []
+        if old_restaurant_id and old_restaurant_id != restaurant_id:
+            events.append(OrderEvent(
+                order_id=order_id,
+                restaurant_id=old_restaurant_id,
+                kind=OrderEvent.UNASSIGNED,
+                status=status,
+            ))
+        if restaurant_id and restaurant_id != old_restaurant_id:
+            kind = OrderEvent.ASSIGNED
+        elif restaurant_id and status != old_status:
+            kind = OrderEvent.UPDATED
+        else:
+            return events
+        events.append(OrderEvent(order_id=order_id, restaurant_id=restaurant_id, kind=kind, status=status))
+        return events
+
+
+class IdempotencyKey(models.Model):
+    key = models.CharField(
+        'ключ',
+        max_length=255,
+        unique=True,
+    )
+    request_hash = models.CharField(
+        'хэш запроса',
+        max_length=64,
+    )
+    response_status = models.PositiveSmallIntegerField(
+        'код ответа',
+        null=True,
+        blank=True,
+    )
+    response_body = models.TextField(
+        'тело ответа',
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        'создан',
+        default=now,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'ключ идемпотентности'
+        verbose_name_plural = 'ключи идемпотентности'
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,147 @@
+"""Phone number fields that memoize parsing.
+
+The same customer numbers come again and again, so the result of the
+`phonenumbers` parse and validation is kept in a bounded LRU cache keyed by
+the normalized string and region. Spaces, dashes, dots and brackets are
+dropped before the lookup, so different spellings of one number share an
+entry, and strings longer than any phone number are never cached. The cache
+holds the parsed numbers only; callers always get their own copy, because
+PhoneNumber objects are mutable.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.translation import gettext_lazy
+from phonenumber_field import modelfields, serializerfields
+from phonenumber_field.phonenumber import PhoneNumber, to_python
+from phonenumber_field.validators import validate_international_phonenumber
+from rest_framework import serializers
+
+
+# longest E.164 number with a long extension still fits
+MAX_PHONENUMBER_LENGTH = 32
+SEPARATORS_PATTERN = re.compile(r'[\s\-.()]+')
+
+
+def get_default_region():
+    return getattr(settings, 'PHONENUMBER_DEFAULT_REGION', None)
+
+
+@lru_cache(maxsize=settings.PHONENUMBER_CACHE_SIZE)
+def parse_cached(value, region):
+    phone_number = to_python(value, region=region)
+    is_valid = phone_number.is_valid()
+    e164 = phone_number.as_e164 if is_valid else None
+    return phone_number, is_valid, e164
+
+
+def normalize_phonenumber(value):
+    return SEPARATORS_PATTERN.sub('', value)
+
+
+def parse_phonenumber(value, region=None):
+    """Return (PhoneNumber, is_valid, E.164 string or None) for a raw value.
+
+    A PhoneNumber that still has its raw input is looked up by that input,
+    so numbers loaded or assigned earlier are not validated again.
+    """
+    region = region or get_default_region()
+    if isinstance(value, PhoneNumber):
+        raw_input = normalize_phonenumber(value.raw_input or '')
+        if raw_input and len(raw_input) <= MAX_PHONENUMBER_LENGTH:
+            _, is_valid, e164 = parse_cached(raw_input, region)
+        else:
+            is_valid = value.is_valid()
+            e164 = value.as_e164 if is_valid else None
+        return value, is_valid, e164
+
+    value = normalize_phonenumber(value)
+    if len(value) > MAX_PHONENUMBER_LENGTH:
+        return to_python(value, region=region), False, None
+    cached_number, is_valid, e164 = parse_cached(value, region)
+    phone_number = PhoneNumber()
+    phone_number.merge_from(cached_number)
+    return phone_number, is_valid, e164
+
+
+def get_phonenumber_digits(value, region=None):
+    """Digits of the E.164 form, or an empty string for an invalid number."""
+    if not value:
+        return ''
+    _, _, e164 = parse_phonenumber(value, region)
+    return e164[1:] if e164 else ''
+
+
+def validate_cached_phonenumber(value):
+    if not isinstance(value, (str, PhoneNumber)) or not value:
+        return validate_international_phonenumber(value)
+    _, is_valid, _ = parse_phonenumber(value)
+    if not is_valid:
+        raise ValidationError(gettext_lazy('The phone number entered is not valid.'), code='invalid')
+
+
+class CachedPhoneNumberDescriptor(modelfields.PhoneNumberDescriptor):
+    def __set__(self, instance, value):
+        if isinstance(value, str) and value:
+            value, _, _ = parse_phonenumber(value, self.field.region)
+        super().__set__(instance, value)
+
+
+class CachedPhoneNumberField(modelfields.PhoneNumberField):
+    descriptor_class = CachedPhoneNumberDescriptor
+    default_validators = [validate_cached_phonenumber]
+
+    def get_prep_value(self, value):
+        if isinstance(value, (str, PhoneNumber)) and value:
+            _, is_valid, e164 = parse_phonenumber(value, self.region)
+            if is_valid and getattr(settings, 'PHONENUMBER_DB_FORMAT', 'E164') == 'E164':
+                value = e164
+        return super().get_prep_value(value)
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str) and value:
+            phone_number, _, _ = parse_phonenumber(value)
+            return phone_number
+        return super().from_db_value(value, expression, connection)
+
+
+class PhoneNumberDigitsField(models.CharField):
+    """E.164 digits of another phone field, filled in on every save."""
+
+    def __init__(self, *args, source=None, **kwargs):
+        kwargs.setdefault('max_length', 15)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+        self.source = source
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        digits = get_phonenumber_digits(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, digits)
+        return digits
+
+
+class CachedPhoneNumberSerializerField(serializerfields.PhoneNumberField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', MAX_PHONENUMBER_LENGTH)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, PhoneNumber):
+            return super().to_internal_value(data)
+        str_value = serializers.CharField.to_internal_value(self, data)
+        # validators run after parsing, check the length before it
+        if self.max_length is not None and len(str_value) > self.max_length:
+            self.fail('max_length', max_length=self.max_length)
+        phone_number, is_valid, _ = parse_phonenumber(str_value, self.region)
+        if phone_number and not is_valid:
+            raise serializers.ValidationError(self.error_messages['invalid'])
+        return phone_number
@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+import orjson
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+
+def encode_default(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    raise TypeError(f'Type is not JSON serializable: {type(obj).__name__}')
+
+
+def dumps(obj):
+    return orjson.dumps(obj, default=encode_default)
+
+
+def iter_json_array(items):
+    yield b'['
+    separator = b''
+    for item in items:
+        yield separator + dumps(item)
+        separator = b','
+    yield b']'
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
@@ -0,0 +1,64 @@
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from .models import Product, ProductSearchDocument
+
+
+FTS_TABLE = 'foodcartapp_productsearch_fts'
+
+_fts_tables = {}
+
+
+def make_search_text(*parts):
+    return ' '.join(part for part in parts if part).casefold()
+
+
+def refresh_search_documents(product_ids, using='default'):
+    products = (
+        Product.objects
+        .using(using)
+        .filter(pk__in=product_ids)
+        .values_list('id', 'name', 'description', 'category__name')
+    )
+    documents = [
+        ProductSearchDocument(
+            product_id=product_id,
+            text=make_search_text(name, category_name, description),
+        )
+        for product_id, name, description, category_name in products
+    ]
+    ProductSearchDocument.objects.using(using).filter(product_id__in=product_ids).delete()
+    ProductSearchDocument.objects.using(using).bulk_create(documents)
+
+
+def has_fts_table(using):
+    if using not in _fts_tables:
+        connection = connections[using]
+        _fts_tables[using] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_tables[using]
+
+
+def search_products(query, queryset=None):
+    """Filter products whose name, description or category match every word.
+
+    Words match by prefix on SQLite with FTS5 and by substring elsewhere.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    terms = query.casefold().split()
+    if not terms:
+        return queryset.none()
+
+    if has_fts_table(queryset.db):
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [match],
+        ))
+
+    for term in terms:
+        queryset = queryset.filter(search_document__text__contains=term)
+    return queryset
@@ -1,10 +1,80 @@
+from django.db import connections
 from rest_framework import serializers
-from phonenumber_field.serializerfields import PhoneNumberField
+from .catalog import PRODUCT_FIELD_COLUMNS
+from .geocoding import geocode_after_commit
 from .models import Product, Order, OrderItem
+from .phones import CachedPhoneNumberSerializerField
+
+
+class ProductPageSerializer(serializers.Serializer):
+    cursor = serializers.IntegerField(min_value=0, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=200, default=50)
+    category = serializers.IntegerField(required=False)
+    special_status = serializers.BooleanField(required=False, allow_null=True, default=None)
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown_fields = [field for field in fields if field not in PRODUCT_FIELD_COLUMNS]
+        if unknown_fields:
+            raise serializers.ValidationError(f'Неизвестные поля: {", ".join(unknown_fields)}')
+        if not fields:
+            raise serializers.ValidationError('Не указано ни одного поля')
+        return fields
+
+    def validate(self, attrs):
+        attrs.setdefault('fields', list(PRODUCT_FIELD_COLUMNS))
+        return attrs
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField()
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class ProductField(serializers.PrimaryKeyRelatedField):
+    """Product primary key field that can use products loaded in advance.
+
+    When the serializer context has a `products` dict from in_bulk(), ids
+    are resolved from it instead of one SELECT per line item.
+    """
+
+    def to_internal_value(self, data):
+        products = self.context.get('products')
+        if products is None:
+            return super().to_internal_value(data)
+
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            product = products.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
+
+# ids out of the 64-bit range can't exist and break the SELECT on SQLite
+MAX_PRODUCT_ID = 2 ** 63 - 1
+
+
+def collect_product_ids(items):
+    product_ids = set()
+    for item in items:
+        if not isinstance(item, dict) or isinstance(item.get('product'), bool):
+            continue
+        try:
+            product_id = int(item.get('product'))
+        except (TypeError, ValueError):
+            continue
+        if 0 < product_id <= MAX_PRODUCT_ID:
+            product_ids.add(product_id)
+    return product_ids
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = serializers.PrimaryKeyRelatedField(
+    product = ProductField(
         queryset=Product.objects.all()
     )
 
@@ -13,20 +83,58 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['product', 'quantity']
 
 
+class OrderListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        orders = []
+        orders_items = []
+        for order_data in validated_data:
+            order_data = dict(order_data)
+            order_items = order_data.pop('products')
+            orders_items.append(order_items)
+            orders.append(Order(**order_data, total_price=Order.get_items_total_price(order_items)))
+
+        # Django 3.2 gets ids back from bulk_create on PostgreSQL only
+        if connections[Order.objects.db].features.can_return_rows_from_bulk_insert:
+            Order.objects.bulk_create(orders)
+        else:
+            for order in orders:
+                order.save()
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item['product'],
+                quantity=item['quantity'],
+                price=item['product'].price,
+            )
+            for order, items in zip(orders, orders_items)
+            for item in items
+        ])
+        geocode_after_commit(order.address for order in orders)
+        return orders
+
+
 class OrderSerializer(serializers.ModelSerializer):
     firstname = serializers.CharField(source='first_name')
     lastname = serializers.CharField(source='last_name')
-    phonenumber = PhoneNumberField()
+    phonenumber = CachedPhoneNumberSerializerField()
     products = OrderItemSerializer(many=True, allow_empty=False, write_only=True)
 
     class Meta:
         model = Order
         fields = ['id', 'firstname', 'lastname', 'phonenumber', 'address', 'products']
+        list_serializer_class = OrderListSerializer
 
+    def to_internal_value(self, data):
+        # all products of the cart are loaded with one in_bulk(), ProductField
+        # takes them from the context
+        if 'products' not in self.context and isinstance(data, dict) and isinstance(data.get('products'), list):
+            self.context['products'] = Product.objects.in_bulk(collect_product_ids(data['products']))
+        return super().to_internal_value(data)
 
     def create(self, validated_data):
         product_data = validated_data.pop('products')
-        order = Order.objects.create(**validated_data)
+        order = Order.objects.create(**validated_data, total_price=Order.get_items_total_price(product_data))
 
         order_items = []
         for item in product_data:
@@ -39,4 +147,5 @@ class OrderSerializer(serializers.ModelSerializer):
             ))
 
         OrderItem.objects.bulk_create(order_items)
+        geocode_after_commit([order.address])
         return order
@@ -0,0 +1,132 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .catalog import banners_snapshot, invalidate_catalog, invalidate_menu_items, invalidate_menus
+from .geocoding import geocode_after_commit
+from .images import make_derivatives
+from .models import Banner, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from .search import refresh_search_documents
+from .spatial import restaurant_locations
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def menu_item_changed(sender, instance, **kwargs):
+    restaurant_ids = {instance.restaurant_id, getattr(instance, 'previous_restaurant_id', None)}
+    restaurant_ids.discard(None)
+    transaction.on_commit(lambda: invalidate_menu_items(restaurant_ids))
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def restaurant_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_menus)
+
+
+@receiver(pre_save, sender=Restaurant)
+def remember_restaurant_address(sender, instance, **kwargs):
+    instance.previous_address = (
+        Restaurant.objects
+        .filter(pk=instance.pk)
+        .values_list('address', flat=True)
+        .first()
+    ) if instance.pk else None
+
+
+@receiver(post_save, sender=Restaurant)
+def invalidate_restaurant_location(sender, instance, created, **kwargs):
+    if created or instance.address != getattr(instance, 'previous_address', None):
+        geocode_after_commit([instance.address])
+        transaction.on_commit(restaurant_locations.invalidate)
+
+
+@receiver(post_delete, sender=Restaurant)
+def forget_restaurant_location(sender, **kwargs):
+    transaction.on_commit(restaurant_locations.invalidate)
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def invalidate_banners(sender, **kwargs):
+    transaction.on_commit(banners_snapshot.invalidate)
+
+
+@receiver(pre_save, sender=RestaurantMenuItem)
+def remember_menu_item_product(sender, instance, **kwargs):
+    previous_state = (
+        RestaurantMenuItem.objects
+        .filter(pk=instance.pk)
+        .values_list('product_id', 'restaurant_id')
+        .first()
+    ) if instance.pk else None
+    instance.previous_product_id, instance.previous_restaurant_id = previous_state or (None, None)
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def refresh_product_availability(sender, instance, **kwargs):
+    product_ids = {instance.product_id, getattr(instance, 'previous_product_id', None)}
+    product_ids.discard(None)
+    Product.objects.filter(pk__in=product_ids).refresh_availability()
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_image(sender, instance, **kwargs):
+    instance.previous_image_name = (
+        Product.objects
+        .filter(pk=instance.pk)
+        .values_list('image', flat=True)
+        .first()
+    ) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def make_product_image_derivatives(sender, instance, **kwargs):
+    if not instance.image or instance.image.name == getattr(instance, 'previous_image_name', None):
+        return
+
+    def make_and_invalidate():
+        # the product is committed already, a broken upload must not fail the request
+        try:
+            make_derivatives(instance.image)
+        except Exception:
+            logger.exception('Не удалось сделать копии картинки %s', instance.image.name)
+            return
+        Product.objects.mark_image_derivatives(instance.image.name)
+        invalidate_catalog()
+
+    transaction.on_commit(make_and_invalidate)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_search_document(sender, instance, using, **kwargs):
+    refresh_search_documents([instance.pk], using=using)
+
+
+@receiver(post_save, sender=ProductCategory)
+def refresh_category_search_documents(sender, instance, using, **kwargs):
+    refresh_search_documents(list(instance.products.values_list('id', flat=True)), using=using)
+
+
+@receiver(pre_delete, sender=ProductCategory)
+def remember_category_products(sender, instance, **kwargs):
+    instance.product_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=ProductCategory)
+def refresh_uncategorized_search_documents(sender, instance, using, **kwargs):
+    refresh_search_documents(getattr(instance, 'product_ids', []), using=using)
@@ -0,0 +1,177 @@
+import gzip
+import hashlib
+import re
+import threading
+import time
+from collections import namedtuple
+
+import brotli
+from django.core.cache import cache
+from django.utils import timezone
+
+
+COMPRESSORS = {
+    'br': lambda body, level: brotli.compress(body, quality=level),
+    'gzip': lambda body, level: gzip.compress(body, compresslevel=level, mtime=0),
+}
+
+# (level when the snapshot is built, level on first request)
+COMPRESSION_LEVELS = {
+    'br': (11, 5),
+    'gzip': (9, 6),
+}
+
+MIN_COMPRESSED_SIZE = 200
+
+ACCEPT_ENCODING_RE = re.compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def choose_encoding(accept_encoding):
+    """Pick the best of COMPRESSORS allowed by an Accept-Encoding header."""
+    weights = {}
+    for coding in accept_encoding.split(','):
+        match = ACCEPT_ENCODING_RE.match(coding)
+        if not match:
+            continue
+        name, weight = match.groups()
+        try:
+            weights[name.lower()] = float(weight) if weight else 1.0
+        except ValueError:
+            continue
+
+    candidates = [
+        (weights.get(encoding, weights.get('*', 0)), -position, encoding)
+        for position, encoding in enumerate(COMPRESSORS)
+    ]
+    weight, _, encoding = max(candidates)
+    return encoding if weight > 0 else None
+
+
+class Snapshot(namedtuple('Snapshot', ['version', 'body', 'etag', 'last_modified', 'expires_at', 'compressed'])):
+    """Response body with its validators.
+
+    Compressed variants are kept for the lifetime of the snapshot. Shared
+    snapshots are compressed at the best level once, while they are built;
+    others are compressed on first use at a cheaper level, so requests
+    racing for a fresh snapshot do not repeat slow compression.
+    """
+
+    __slots__ = ()
+
+    def precompress(self):
+        if len(self.body) < MIN_COMPRESSED_SIZE:
+            return
+        for encoding, compress in COMPRESSORS.items():
+            build_level, _ = COMPRESSION_LEVELS[encoding]
+            self.compressed[encoding] = compress(self.body, build_level)
+
+    def get_encoding(self, accept_encoding):
+        if len(self.body) < MIN_COMPRESSED_SIZE:
+            return None
+        return choose_encoding(accept_encoding)
+
+    def get_body(self, encoding=None):
+        if not encoding:
+            return self.body
+        if encoding not in self.compressed:
+            _, request_level = COMPRESSION_LEVELS[encoding]
+            self.compressed[encoding] = COMPRESSORS[encoding](self.body, request_level)
+        return self.compressed[encoding]
+
+    def get_etag(self, encoding=None):
+        if not encoding:
+            return self.etag
+        return '{}-{}"'.format(self.etag[:-1], encoding)
+
+
+def make_version(previous_version=0):
+    """Return a version in milliseconds, in a later second than the previous one.
+
+    Last-Modified is the version in whole seconds, so two versions from the
+    same second would look the same to an If-Modified-Since client.
+    """
+    return max(int(time.time() * 1000), (previous_version // 1000 + 1) * 1000)
+
+
+def make_snapshot(version, body, expires_at=None):
+    return Snapshot(
+        version=version,
+        body=body,
+        etag='"{}"'.format(hashlib.sha1(body).hexdigest()),
+        last_modified=version // 1000,
+        expires_at=expires_at,
+        compressed={},
+    )
+
+
+class VersionedValue:
+    """Value built from the database and kept in the memory of every worker.
+
+    Workers share only a version number stored in the Django cache, so a
+    freshness check never touches the database. The value is rebuilt lazily
+    by the first request that sees a version different from its own.
+
+    `get_expires_at` is for values that change with time alone: once the
+    moment it returns has passed, every worker rebuilds its own value
+    without touching the shared version.
+    """
+
+    def __init__(self, name, build=None, get_expires_at=None):
+        self.version_key = f'foodcartapp:{name}:version'
+        self.build = build
+        self.get_expires_at = get_expires_at
+        self._version = None
+        self._value = None
+        self._value_version = None
+        self._expires_at = None
+        self._lock = threading.Lock()
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, make_version(), timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        version = cache.get(self.version_key) or 0
+        cache.set(self.version_key, make_version(version), timeout=None)
+
+    def is_expired(self):
+        return self._expires_at is not None and self._expires_at <= timezone.now()
+
+    def get(self):
+        version = self.get_version()
+        if self._version == version and not self.is_expired():
+            return self._value
+
+        with self._lock:
+            if self._version != version:
+                value_version = version
+            elif self.is_expired():
+                # the same moment on every worker, so they agree on Last-Modified
+                value_version = int(self._expires_at.timestamp() * 1000)
+            else:
+                return self._value
+            if self._value_version is not None:
+                value_version = max(value_version, (self._value_version // 1000 + 1) * 1000)
+
+            expires_at = self.get_expires_at() if self.get_expires_at else None
+            self._value = self.make_value(value_version, expires_at)
+            self._value_version = value_version
+            self._expires_at = expires_at
+            self._version = version
+            return self._value
+
+    def make_value(self, version, expires_at):
+        return self.build()
+
+
+class VersionedSnapshot(VersionedValue):
+    """Prebuilt response body with its ETag, see VersionedValue."""
+
+    def make_value(self, version, expires_at):
+        # runs under the build lock, other requests wait for the compressed bodies
+        snapshot = make_snapshot(version, self.build(), expires_at)
+        snapshot.precompress()
+        return snapshot
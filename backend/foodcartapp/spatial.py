@@ -0,0 +1,172 @@
+"""Nearest-restaurant lookups over a KD-tree of restaurant coordinates.
+
+Points are kept as unit vectors in 3D: the straight-line (chord) distance
+between them grows with the great-circle distance, so the tree can prune
+subtrees by a plain coordinate difference and a query visits only the
+neighbourhood of the point instead of every restaurant. Distances of the
+points found are then recomputed on the WGS-84 ellipsoid, pair by pair for
+a few points and as one NumPy row when an order has many candidates.
+"""
+import heapq
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from backend.places.models import Place
+
+from .distances import EARTH_RADIUS_KM, get_distance_km, get_distance_matrix_km
+from .models import Restaurant
+from .snapshots import VersionedValue
+from .utils import fetch_coordinates_bulk
+
+
+# the sphere is up to 0.5% off the ellipsoid, radius queries look a bit further
+SPHERE_SLACK = 1.01
+
+# below this many points plain floats beat the NumPy call overhead
+MATRIX_MIN_POINTS = 24
+
+
+def to_unit_vector(coords):
+    lat, lon = map(math.radians, coords)
+    return (
+        math.cos(lat) * math.cos(lon),
+        math.cos(lat) * math.sin(lon),
+        math.sin(lat),
+    )
+
+
+def get_chord(distance_km):
+    return 2 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class SpatialIndex:
+    """KD-tree of items with (latitude, longitude) coordinates."""
+
+    def __init__(self, items, coords):
+        self.items = list(items)
+        self.coords = list(coords)
+        self.points = [to_unit_vector(point_coords) for point_coords in self.coords]
+        self.root = self.build(list(range(len(self.items))), depth=0)
+
+    def __len__(self):
+        return len(self.items)
+
+    def build(self, indexes, depth):
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda index: self.points[index][axis])
+        middle = len(indexes) // 2
+        return (
+            indexes[middle],
+            axis,
+            self.build(indexes[:middle], depth + 1),
+            self.build(indexes[middle + 1:], depth + 1),
+        )
+
+    def search(self, target, max_chord, limit=None, accept=None):
+        """Return (chord, index) pairs closer than max_chord, the nearest first.
+
+        With a limit only that many nearest pairs are kept, and the search
+        radius shrinks to the farthest of them once they are found.
+        """
+        found = []  # max-heap on chord while a limit is set
+
+        def visit(node, max_chord):
+            if node is None:
+                return max_chord
+            index, axis, left, right = node
+            difference = target[axis] - self.points[index][axis]
+            chord = math.dist(target, self.points[index])
+            if chord <= max_chord and (accept is None or accept(self.items[index])):
+                heapq.heappush(found, (-chord, index))
+                if limit is not None and len(found) > limit:
+                    heapq.heappop(found)
+                if limit is not None and len(found) == limit:
+                    max_chord = -found[0][0]
+
+            near, far = (left, right) if difference < 0 else (right, left)
+            max_chord = visit(near, max_chord)
+            if abs(difference) <= max_chord:
+                max_chord = visit(far, max_chord)
+            return max_chord
+
+        visit(self.root, max_chord)
+        return sorted((-negative_chord, index) for negative_chord, index in found)
+
+    def get_distances(self, coords, found):
+        indexes = [index for _, index in found]
+        found_coords = [self.coords[index] for index in indexes]
+        if len(indexes) >= MATRIX_MIN_POINTS:
+            distances = get_distance_matrix_km([coords], found_coords)[0].tolist()
+        else:
+            distances = [get_distance_km(coords, point_coords) for point_coords in found_coords]
+        return sorted(
+            zip((self.items[index] for index in indexes), distances),
+            key=lambda item_distance: item_distance[1],
+        )
+
+    def nearest(self, coords, limit, accept=None):
+        """Return up to `limit` (item, distance in km) pairs nearest to coords.
+
+        `accept` filters items, e.g. down to restaurants that can cook an order.
+        """
+        if not limit:
+            return []
+        target = to_unit_vector(coords)
+        found = self.search(target, max_chord=2, limit=limit, accept=accept)
+        if len(found) == limit:
+            # the order on the ellipsoid may differ a little, so take the
+            # points that are almost as near as well
+            found = self.search(target, max_chord=found[-1][0] * SPHERE_SLACK, accept=accept)
+        return self.get_distances(coords, found)[:limit]
+
+    def within(self, coords, radius_km, accept=None):
+        """Return (item, distance in km) pairs not farther than radius_km, the nearest first."""
+        found = self.search(to_unit_vector(coords), get_chord(radius_km * SPHERE_SLACK), accept=accept)
+        return [
+            (item, distance)
+            for item, distance in self.get_distances(coords, found)
+            if distance <= radius_km
+        ]
+
+
+def build_restaurant_locations():
+    # only coordinates already in Place are used, addresses without them go
+    # to the background geocoder and get into the index once it expires
+    addresses = dict(Restaurant.objects.exclude(address='').values_list('id', 'address'))
+    coords_by_address = fetch_coordinates_bulk(addresses.values())
+    located_restaurants = {
+        restaurant_id: coords_by_address[address]
+        for restaurant_id, address in addresses.items()
+        if address in coords_by_address
+    }
+    return SpatialIndex(located_restaurants.keys(), located_restaurants.values())
+
+
+def get_restaurant_locations_expiry():
+    """Rebuild the index later if some restaurant addresses are not geocoded yet."""
+    located_addresses = (
+        Place.objects
+        .filter(latitude__isnull=False, longitude__isnull=False)
+        .values('address')
+    )
+    has_unlocated = (
+        Restaurant.objects
+        .exclude(address='')
+        .exclude(address__in=located_addresses)
+        .exists()
+    )
+    if has_unlocated:
+        return timezone.now() + timedelta(seconds=settings.RESTAURANT_LOCATIONS_RETRY_INTERVAL)
+    return None
+
+
+restaurant_locations = VersionedValue(
+    'restaurant_locations',
+    build=build_restaurant_locations,
+    get_expires_at=get_restaurant_locations_expiry,
+)
@@ -0,0 +1,918 @@
+import io
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+
+import brotli
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import F
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from geopy.distance import geodesic
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from . import geocoding, intake, kitchen_feed, phones, search, signals, spatial, throttling, utils
+from .catalog import build_product_restaurants_index, catalog_snapshot, menu_matrix
+from .distances import get_distance_km, get_distance_matrix_km
+from .images import get_derivative_name
+from .models import Order, OrderEvent, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from .serializers import OrderSerializer
+from .spatial import SpatialIndex
+from .snapshots import VersionedSnapshot, VersionedValue, choose_encoding, make_snapshot
+from .views import snapshot_response
+
+
+class ProductAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Ресторан')
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.png')
+        cls.fries = Product.objects.create(name='Картошка', price=50, image='fries.png')
+
+    def get_count(self, product):
+        return Product.objects.get(pk=product.pk).available_restaurants_count
+
+    def test_save_keeps_counter_changed_meanwhile(self):
+        stale_burger = Product.objects.get(pk=self.burger.pk)
+        RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=self.burger)
+
+        stale_burger.name = 'Чизбургер'
+        stale_burger.save()
+
+        self.assertEqual(self.get_count(self.burger), 1)
+        self.assertEqual(Product.objects.get(pk=self.burger.pk).name, 'Чизбургер')
+
+    def test_bulk_update_moves_availability(self):
+        menu_item = RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=self.burger)
+
+        menu_item.product = self.fries
+        RestaurantMenuItem.objects.bulk_update([menu_item], ['product'])
+
+        self.assertEqual(self.get_count(self.burger), 0)
+        self.assertEqual(self.get_count(self.fries), 1)
+
+    def test_update_with_expression(self):
+        RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=self.burger)
+
+        RestaurantMenuItem.objects.update(product=F('product') + (self.fries.pk - self.burger.pk))
+
+        self.assertEqual(self.get_count(self.burger), 0)
+        self.assertEqual(self.get_count(self.fries), 1)
+
+
+class VersionedValueTests(TestCase):
+    def test_expired_value_is_rebuilt_without_new_version(self):
+        builds = itertools.count()
+        value = VersionedValue('test-expiring', build=lambda: next(builds), get_expires_at=timezone.now)
+        value.invalidate()
+        version = value.get_version()
+
+        self.assertEqual(value.get(), 0)
+        self.assertEqual(value.get(), 1)
+        self.assertEqual(value.get_version(), version)
+
+    def test_each_version_has_own_last_modified(self):
+        snapshot = VersionedSnapshot('test-last-modified', build=lambda: b'[]')
+        snapshot.invalidate()
+        last_modified = snapshot.get().last_modified
+
+        snapshot.invalidate()
+
+        self.assertGreater(snapshot.get().last_modified, last_modified)
+
+
+class ProductListApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Ресторан')
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.png')
+        cls.menu_item = RestaurantMenuItem.objects.create(restaurant=cls.restaurant, product=cls.burger)
+
+    def setUp(self):
+        catalog_snapshot.invalidate()
+
+    def get_products(self, **headers):
+        return self.client.get('/api/products/', **headers)
+
+    def test_unchanged_catalog_is_not_modified(self):
+        etag = self.get_products()['ETag']
+
+        response = self.get_products(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_product_change_gives_new_etag(self):
+        etag = self.get_products()['ETag']
+
+        self.burger.name = 'Чизбургер'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.burger.save()
+        response = self.get_products(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'Чизбургер')
+
+    def test_menu_item_change_gives_new_etag(self):
+        etag = self.get_products()['ETag']
+
+        self.menu_item.availability = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu_item.save()
+        response = self.get_products(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json(), [])
+
+
+class AcceptEncodingTests(TestCase):
+    def test_best_allowed_encoding_is_chosen(self):
+        cases = [
+            ('gzip, deflate, br', 'br'),
+            ('gzip;q=1.0, br;q=0.5', 'gzip'),
+            ('gzip, br;q=0', 'gzip'),
+            ('BR', 'br'),
+            ('*', 'br'),
+            ('*, br;q=0', 'gzip'),
+            ('identity', None),
+            ('gzip;q=0, br;q=0', None),
+            ('', None),
+            ('gzip;q=abc, br', 'br'),
+        ]
+        for accept_encoding, encoding in cases:
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertEqual(choose_encoding(accept_encoding), encoding)
+
+    def test_small_body_is_not_compressed(self):
+        snapshot = make_snapshot(1, b'[]')
+
+        self.assertIsNone(snapshot.get_encoding('br, gzip'))
+
+    def test_response_is_compressed_and_varies_by_encoding(self):
+        body = json.dumps([{'name': f'Бургер {number}'} for number in range(20)]).encode()
+        snapshot = make_snapshot(1, body)
+        request = RequestFactory().get('/api/products/', HTTP_ACCEPT_ENCODING='gzip, br')
+
+        response = snapshot_response(request, snapshot)
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].endswith('-br"'))
+
+        request = RequestFactory().get('/api/products/', HTTP_ACCEPT_ENCODING='identity')
+        response = snapshot_response(request, snapshot)
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], snapshot.etag)
+
+    def test_not_modified_response_varies_by_encoding(self):
+        snapshot = make_snapshot(1, b'[' + b'0,' * 200 + b'0]')
+        request = RequestFactory().get(
+            '/api/products/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=snapshot.get_etag('gzip'),
+        )
+
+        response = snapshot_response(request, snapshot)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+
+class ProductImageDerivativesTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def save_product(self, image_name, content):
+        product = Product(name='Бургер', price=100, image=SimpleUploadedFile(image_name, content))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        return Product.objects.get(pk=product.pk)
+
+    def test_copies_of_different_formats_do_not_clash(self):
+        self.assertNotEqual(
+            get_derivative_name('burger.png', 'medium'),
+            get_derivative_name('burger.jpg', 'medium'),
+        )
+
+    def test_made_copies_are_recorded(self):
+        image_file = io.BytesIO()
+        Image.new('RGB', (800, 600)).save(image_file, 'PNG')
+
+        product = self.save_product('burger.png', image_file.getvalue())
+
+        self.assertEqual(product.image_derivatives_source, product.image.name)
+
+    def test_broken_upload_is_logged(self):
+        with self.assertLogs(signals.logger, 'ERROR'):
+            product = self.save_product('broken.png', b'not an image')
+
+        self.assertEqual(product.image_derivatives_source, '')
+
+
+class MenuMatrixTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first_restaurant = Restaurant.objects.create(name='Первый')
+        cls.second_restaurant = Restaurant.objects.create(name='Второй')
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.png')
+        cls.first_menu_item = RestaurantMenuItem.objects.create(restaurant=cls.first_restaurant, product=cls.burger)
+        RestaurantMenuItem.objects.create(restaurant=cls.second_restaurant, product=cls.burger)
+
+    def setUp(self):
+        menu_matrix.invalidate()
+
+    def test_availability_change_rebuilds_only_its_row(self):
+        second_menu = menu_matrix.get_menu(self.second_restaurant.id)
+        self.assertIn(b'"id":%d' % self.burger.id, menu_matrix.get_menu(self.first_restaurant.id).body)
+        matrix_version = menu_matrix.get_version()
+
+        self.first_menu_item.availability = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first_menu_item.save()
+
+        self.assertEqual(menu_matrix.get_version(), matrix_version)
+        self.assertEqual(menu_matrix.get_menu(self.first_restaurant.id).body, b'[]')
+        self.assertIs(menu_matrix.get_menu(self.second_restaurant.id), second_menu)
+
+
+class ProductRestaurantsIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first_restaurant = Restaurant.objects.create(name='Первый')
+        cls.second_restaurant = Restaurant.objects.create(name='Второй')
+        cls.third_restaurant = Restaurant.objects.create(name='Третий')
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.png')
+        cls.fries = Product.objects.create(name='Картошка', price=50, image='fries.png')
+        cls.shake = Product.objects.create(name='Коктейль', price=70, image='shake.png')
+        for restaurant in [cls.first_restaurant, cls.second_restaurant, cls.third_restaurant]:
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=cls.burger)
+        RestaurantMenuItem.objects.create(restaurant=cls.first_restaurant, product=cls.fries)
+        RestaurantMenuItem.objects.create(restaurant=cls.third_restaurant, product=cls.fries)
+        RestaurantMenuItem.objects.create(restaurant=cls.third_restaurant, product=cls.shake, availability=False)
+
+    def test_restaurants_cook_all_products_of_order(self):
+        index = build_product_restaurants_index()
+
+        self.assertEqual(
+            index.get_restaurants([self.burger.id]),
+            [self.first_restaurant, self.second_restaurant, self.third_restaurant],
+        )
+        self.assertEqual(
+            index.get_restaurants([self.burger.id, self.fries.id]),
+            [self.first_restaurant, self.third_restaurant],
+        )
+        self.assertEqual(index.get_restaurants([self.fries.id, self.shake.id]), [])
+        self.assertEqual(index.get_restaurants([]), [])
+
+    def test_restaurant_with_unavailable_menu_has_no_bit(self):
+        RestaurantMenuItem.objects.filter(restaurant=self.second_restaurant).update(availability=False)
+
+        index = build_product_restaurants_index()
+
+        self.assertEqual(index.restaurants, [self.first_restaurant, self.third_restaurant])
+        self.assertEqual(index.get_mask([self.burger.id]), 0b11)
+
+
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        # points spread over Moscow
+        self.coords = [(55.55 + rng.random() * 0.35, 37.35 + rng.random() * 0.5) for _ in range(40)]
+        self.index = SpatialIndex(range(len(self.coords)), self.coords)
+        self.order_coords = (55.75, 37.61)
+
+    def test_many_candidates_are_measured_as_one_matrix_row(self):
+        with mock.patch.object(spatial, 'get_distance_matrix_km', wraps=get_distance_matrix_km) as get_matrix:
+            found = self.index.within(self.order_coords, radius_km=100)
+
+        get_matrix.assert_called_once()
+        self.assertEqual(len(found), len(self.coords))
+        self.assertEqual([distance for _, distance in found], sorted(distance for _, distance in found))
+        for item, distance in found:
+            self.assertAlmostEqual(distance, geodesic(self.order_coords, self.coords[item]).km, places=3)
+
+    def test_few_candidates_are_measured_pair_by_pair(self):
+        with mock.patch.object(spatial, 'get_distance_matrix_km') as get_matrix:
+            found = self.index.nearest(self.order_coords, limit=3)
+
+        get_matrix.assert_not_called()
+        self.assertEqual(len(found), 3)
+        nearest_items = sorted(
+            range(len(self.coords)),
+            key=lambda item: geodesic(self.order_coords, self.coords[item]).km,
+        )[:3]
+        self.assertEqual([item for item, _ in found], nearest_items)
+
+    def test_matrix_matches_pairwise_distances(self):
+        matrix = get_distance_matrix_km([self.order_coords, self.coords[0]], self.coords)
+
+        self.assertEqual(matrix.shape, (2, len(self.coords)))
+        self.assertEqual(matrix[1, 0], 0)
+        for row, from_coords in zip(matrix.tolist(), [self.order_coords, self.coords[0]]):
+            for distance, to_coords in zip(row, self.coords):
+                self.assertAlmostEqual(distance, get_distance_km(from_coords, to_coords), places=9)
+
+
+class ProductPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.burgers = ProductCategory.objects.create(name='Бургеры')
+        restaurant = Restaurant.objects.create(name='Ресторан')
+        cls.products = [
+            Product.objects.create(
+                name=f'Бургер {number}',
+                price=100 + number,
+                image='burger.png',
+                category=cls.burgers if number % 2 else None,
+                special_status=number == 3,
+            )
+            for number in range(5)
+        ]
+        for product in cls.products:
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+        cls.unavailable_product = Product.objects.create(name='Снят с продажи', price=10, image='old.png')
+
+    def get_page(self, **params):
+        return self.client.get('/api/products/', params)
+
+    def test_pages_follow_cursor(self):
+        product_ids = []
+        cursor = None
+        while True:
+            params = {'limit': 2} if cursor is None else {'limit': 2, 'cursor': cursor}
+            response = self.get_page(**params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            product_ids += [product['id'] for product in page['results']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(product_ids, [product.id for product in self.products])
+
+    def test_last_page_has_no_cursor(self):
+        page = self.get_page(limit=5).json()
+
+        self.assertEqual(len(page['results']), 5)
+        self.assertIsNone(page['next_cursor'])
+
+        page = self.get_page(cursor=self.products[-1].id).json()
+
+        self.assertEqual(page, {'next_cursor': None, 'results': []})
+
+    def test_only_requested_fields_are_returned(self):
+        page = self.get_page(fields='name, price', limit=1).json()
+
+        self.assertEqual(page['results'], [{'name': 'Бургер 0', 'price': '100.00'}])
+
+    def test_filters(self):
+        page = self.get_page(category=self.burgers.id, fields='id').json()
+        self.assertEqual(page['results'], [{'id': self.products[1].id}, {'id': self.products[3].id}])
+
+        page = self.get_page(special_status='true', fields='id').json()
+        self.assertEqual(page['results'], [{'id': self.products[3].id}])
+
+    def test_bad_params_are_rejected(self):
+        for params in [{'cursor': 'abc'}, {'cursor': -1}, {'limit': 0}, {'fields': 'name,secret'}, {'fields': ','}]:
+            with self.subTest(params=params):
+                response = self.get_page(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(params)), response.json())
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        restaurant = Restaurant.objects.create(name='Ресторан')
+        cls.cheeseburger = Product.objects.create(name='Чизбургер', price=120, image='cheeseburger.png')
+        cls.burger = Product.objects.create(
+            name='Бургер', price=100, image='burger.png', description='С говяжьей котлетой',
+        )
+        cls.fries = Product.objects.create(name='Картошка фри', price=50, image='fries.png')
+        for product in [cls.cheeseburger, cls.burger, cls.fries]:
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+
+    def search(self, query):
+        response = self.client.get('/api/products/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.json()]
+
+    def test_cyrillic_query_ignores_case(self):
+        self.assertEqual(self.search('ЧИЗ'), [self.cheeseburger.id])
+        self.assertEqual(self.search('бург'), [self.burger.id])
+        self.assertEqual(self.search('бургер КОТЛЕТ'), [self.burger.id])
+
+    def test_substring_search_without_fts_table(self):
+        with mock.patch.dict(search._fts_tables, {'default': False}):
+            self.assertEqual(self.search('ЧИЗ'), [self.cheeseburger.id])
+            self.assertEqual(self.search('бург'), [self.cheeseburger.id, self.burger.id])
+            self.assertEqual(self.search('фри картош'), [self.fries.id])
+
+    def test_renamed_product_is_found_by_new_name(self):
+        self.fries.name = 'Наггетсы'
+        self.fries.save()
+
+        self.assertEqual(self.search('картош'), [])
+        self.assertEqual(self.search('НАГГ'), [self.fries.id])
+
+    def test_empty_query_is_rejected(self):
+        self.assertEqual(self.client.get('/api/products/search/', {'q': ''}).status_code, 400)
+
+
+@override_settings(ORDER_THROTTLE_RATES={}, ORDER_MAX_CONCURRENT_INSERTS=0)
+class RegisterOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}', price=100 + number, image='burger.png')
+            for number in range(20)
+        ]
+
+    def post_order(self, products):
+        return self.client.post('/api/order/', {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79161234567',
+            'address': 'Москва, Тверская, 1',
+            'products': [{'product': product.id, 'quantity': 2} for product in products],
+        }, content_type='application/json')
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        for cart_size in (1, 20):
+            with self.subTest(cart_size=cart_size), self.assertNumQueries(8):
+                response = self.post_order(self.products[:cart_size])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(Order.objects.get(pk=response.json()['id']).items.count(), cart_size)
+
+    def test_unknown_product_is_rejected(self):
+        response = self.client.post('/api/order/', {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79161234567',
+            'address': 'Москва, Тверская, 1',
+            'products': [{'product': 999, 'quantity': 1}],
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('products', response.json())
+
+    def test_idempotency_key_with_huge_integer_in_body(self):
+        body = {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79161234567',
+            'address': 'Москва, Тверская, 1',
+            'products': [{'product': 2 ** 70, 'quantity': 1}],
+        }
+        for _ in range(2):
+            response = self.client.post(
+                '/api/order/', body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='huge-product-id',
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ORDER_THROTTLE_RATES={}, ORDER_MAX_CONCURRENT_INSERTS=0)
+class OrderBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Бургер', price=100, image='burger.png')
+
+    def get_order_data(self, **fields):
+        return {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79161234567',
+            'address': 'Москва, Тверская, 1',
+            'products': [{'product': self.product.id, 'quantity': 2}],
+            **fields,
+        }
+
+    def post_batch(self, orders_data):
+        return self.client.post('/api/orders/batch/', orders_data, content_type='application/json')
+
+    def patch_bulk_insert_ids(self, can_return_rows):
+        # only the check of the order serializer, the database keeps its features
+        connections = mock.MagicMock()
+        connections.__getitem__.return_value.features.can_return_rows_from_bulk_insert = can_return_rows
+        return mock.patch('foodcartapp.serializers.connections', connections)
+
+    def test_all_valid_orders_are_created(self):
+        response = self.post_batch([self.get_order_data(), self.get_order_data(firstname='Пётр')])
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'created'])
+        orders = Order.objects.order_by('id')
+        self.assertEqual([result['id'] for result in results], [order.id for order in orders])
+        self.assertEqual([order.first_name for order in orders], ['Иван', 'Пётр'])
+        self.assertEqual([order.total_price for order in orders], [200, 200])
+
+    def test_invalid_orders_get_errors_at_their_indexes(self):
+        response = self.post_batch([
+            self.get_order_data(products=[]),
+            self.get_order_data(),
+            self.get_order_data(products=[{'product': self.product.id + 1000, 'quantity': 1}]),
+        ])
+
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2])
+        self.assertEqual([result['status'] for result in results], ['error', 'created', 'error'])
+        self.assertIn('products', results[0]['errors'])
+        self.assertIn('products', results[2]['errors'])
+        self.assertEqual(list(Order.objects.values_list('id', flat=True)), [results[1]['id']])
+
+    def test_batch_without_valid_orders_is_rejected(self):
+        response = self.post_batch([self.get_order_data(phonenumber='123'), self.get_order_data(products=[])])
+
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertIn('phonenumber', results[0]['errors'])
+        self.assertIn('products', results[1]['errors'])
+        self.assertFalse(Order.objects.exists())
+
+    def test_non_list_body_is_rejected(self):
+        self.assertEqual(self.post_batch(self.get_order_data()).status_code, 400)
+        self.assertEqual(self.post_batch([]).status_code, 400)
+
+    def test_orders_are_saved_one_by_one_without_bulk_insert_ids(self):
+        with self.patch_bulk_insert_ids(False), \
+                mock.patch.object(Order.objects, 'bulk_create') as bulk_create:
+            response = self.post_batch([self.get_order_data(), self.get_order_data()])
+
+        self.assertEqual(response.status_code, 201)
+        bulk_create.assert_not_called()
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_orders_are_bulk_inserted_when_ids_come_back(self):
+        def bulk_create(orders):
+            # PostgreSQL returns the ids of the inserted rows
+            for order in orders:
+                order.save()
+            return orders
+
+        with self.patch_bulk_insert_ids(True), \
+                mock.patch.object(Order.objects, 'bulk_create', side_effect=bulk_create) as bulk_create_mock:
+            response = self.post_batch([self.get_order_data(), self.get_order_data()])
+
+        self.assertEqual(response.status_code, 201)
+        bulk_create_mock.assert_called_once()
+        self.assertEqual(len(bulk_create_mock.call_args.args[0]), 2)
+        self.assertEqual(
+            sorted(Order.objects.values_list('items__quantity', flat=True)),
+            [2, 2],
+        )
+
+
+class OrderTotalPriceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.png')
+        cls.fries = Product.objects.create(name='Картошка', price=50, image='fries.png')
+        cls.order = Order.objects.create(
+            first_name='Иван', last_name='Петров', phonenumber='+79161234567', address='Москва, Тверская, 1',
+        )
+        cls.burger_item = OrderItem.objects.create(order=cls.order, product=cls.burger, quantity=2, price=100)
+        Order.objects.filter(pk=cls.order.pk).refresh_total_price()
+
+    def get_total_price(self):
+        return Order.objects.get(pk=self.order.pk).total_price
+
+    def test_total_price_follows_item_changes(self):
+        self.assertEqual(self.get_total_price(), 200)
+
+        OrderItem.objects.bulk_create([OrderItem(order=self.order, product=self.fries, quantity=1, price=50)])
+        Order.objects.filter(pk=self.order.pk).refresh_total_price()
+        self.assertEqual(self.get_total_price(), 250)
+
+        OrderItem.objects.filter(product=self.fries).update(quantity=F('quantity') + 2)
+        Order.objects.filter(pk=self.order.pk).refresh_total_price()
+        self.assertEqual(self.get_total_price(), 350)
+
+        self.burger_item.quantity = 1
+        self.burger_item.save()
+        Order.objects.filter(pk=self.order.pk).refresh_total_price()
+        self.assertEqual(self.get_total_price(), 250)
+
+        OrderItem.objects.filter(order=self.order).delete()
+        Order.objects.filter(pk=self.order.pk).refresh_total_price()
+        self.assertEqual(self.get_total_price(), 0)
+
+    def test_refresh_touches_only_selected_orders(self):
+        other_order = Order.objects.create(first_name='Пётр', last_name='Иванов', phonenumber='+79161234568')
+        OrderItem.objects.create(order=other_order, product=self.fries, quantity=1, price=50)
+
+        self.assertEqual(Order.objects.filter(pk=other_order.pk).refresh_total_price(), 1)
+
+        self.assertEqual(Order.objects.get(pk=other_order.pk).total_price, 50)
+        self.assertEqual(self.get_total_price(), 200)
+
+    def test_admin_recomputes_total_price_after_items_are_saved(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+
+        response = self.client.post(reverse('admin:foodcartapp_order_change', args=[self.order.pk]), {
+            'first_name': 'Иван',
+            'last_name': 'Петров',
+            'phonenumber': '+79161234567',
+            'address': 'Москва, Тверская, 1',
+            'status': Order.NEW,
+            'payment_method': Order.CASH,
+            'cooking_restaurant': '',
+            'comment': '',
+            'called_at_0': '',
+            'called_at_1': '',
+            'delivered_at_0': '',
+            'delivered_at_1': '',
+            'items-TOTAL_FORMS': '2',
+            'items-INITIAL_FORMS': '1',
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': self.burger_item.pk,
+            'items-0-order': self.order.pk,
+            'items-0-product': self.burger.pk,
+            'items-0-quantity': '3',
+            'items-0-price': '100',
+            'items-1-order': self.order.pk,
+            'items-1-product': self.fries.pk,
+            'items-1-quantity': '1',
+            'items-1-price': '50',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.get_total_price(), 350)
+
+
+class PhoneNumberCacheTests(TestCase):
+    def setUp(self):
+        phones.parse_cached.cache_clear()
+
+    def test_spellings_of_one_number_share_cache_entry(self):
+        for spelling in ('+7 916 123-45-67', '+7 (916) 123 45 67', '+7.916.123.45.67'):
+            _, is_valid, e164 = phones.parse_phonenumber(spelling)
+            self.assertTrue(is_valid)
+            self.assertEqual(e164, '+79161234567')
+
+        self.assertEqual(phones.parse_cached.cache_info().currsize, 1)
+
+    def test_long_strings_are_not_cached(self):
+        _, is_valid, _ = phones.parse_phonenumber('+7' + '1' * 100)
+
+        self.assertFalse(is_valid)
+        self.assertEqual(phones.parse_cached.cache_info().currsize, 0)
+
+    def test_serializer_rejects_long_strings_before_parsing(self):
+        field = phones.CachedPhoneNumberSerializerField()
+
+        with self.assertRaises(ValidationError):
+            field.run_validation('+7' + '1' * 100)
+        self.assertEqual(phones.parse_cached.cache_info().currsize, 0)
+
+
+@override_settings(ORDER_THROTTLE_RATES={'ip': '1/min'}, ORDER_MAX_CONCURRENT_INSERTS=0)
+class OrderThrottleTests(TestCase):
+    def setUp(self):
+        throttle_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(throttle_dir.cleanup)
+        buckets_override = mock.patch.object(
+            throttling, 'buckets', throttling.TokenBucketStore(os.path.join(throttle_dir.name, 'buckets.sqlite3')),
+        )
+        buckets_override.start()
+        self.addCleanup(buckets_override.stop)
+
+    def post_order(self, forwarded_for):
+        return self.client.post('/api/order/', {}, content_type='application/json', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    def test_forged_forwarded_for_does_not_reset_limit(self):
+        # forged address, client address added by the host nginx, host
+        # nginx address added by the docker nginx
+        self.assertEqual(self.post_order('1.1.1.1, 192.0.2.17, 172.18.0.1').status_code, 400)
+
+        response = self.post_order('2.2.2.2, 192.0.2.17, 172.18.0.1')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_clients_behind_both_proxies_have_own_limits(self):
+        self.assertEqual(self.post_order('192.0.2.21, 172.18.0.1').status_code, 400)
+
+        self.assertEqual(self.post_order('192.0.2.22, 172.18.0.1').status_code, 400)
+
+    def test_locked_counters_ask_to_retry(self):
+        locked = mock.patch.object(throttling.buckets, 'take', side_effect=sqlite3.OperationalError('database is locked'))
+        with locked, self.assertLogs(throttling.logger, 'WARNING'):
+            response = self.post_order('192.0.2.18')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class OrderIntakeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Бургер', price=100, image='burger.png')
+
+    def setUp(self):
+        intake_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(intake_dir.cleanup)
+        settings_override = override_settings(ORDER_INTAKE_DIR=intake_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.order_data = {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79161234567',
+            'address': 'Москва, Тверская, 1',
+            'products': [{'product': self.product.id, 'quantity': 1}],
+        }
+
+    def test_workers_do_not_share_claimed_files(self):
+        intake_ids = [intake.enqueue_order(self.order_data) for _ in range(3)]
+
+        with intake.intake_worker() as first_dir, intake.intake_worker() as second_dir:
+            first_paths = intake.claim_batch(first_dir, 2)
+            intake.reclaim_abandoned_files()
+            second_paths = intake.claim_batch(second_dir, 2)
+
+        self.assertEqual(len(first_paths), 2)
+        self.assertEqual(len(second_paths), 1)
+        self.assertEqual(
+            sorted(os.path.basename(path) for path in first_paths + second_paths),
+            sorted(f'{intake_id}.json' for intake_id in intake_ids),
+        )
+
+    def test_files_of_a_finished_worker_are_reclaimed(self):
+        intake_id = intake.enqueue_order(self.order_data)
+        with intake.intake_worker() as claim_dir:
+            intake.claim_batch(claim_dir, 1)
+
+        self.assertEqual(intake.get_intake_status(intake_id)['status'], intake.QUEUED)
+        intake.reclaim_abandoned_files()
+        with intake.intake_worker() as claim_dir:
+            self.assertEqual(intake.drain_batch(claim_dir, 10), 1)
+
+        self.assertEqual(intake.get_intake_status(intake_id)['status'], intake.CREATED)
+        self.assertEqual(Order.objects.filter(intake_id=intake_id).count(), 1)
+
+    def test_order_created_before_crash_is_not_inserted_again(self):
+        intake_id = intake.enqueue_order(self.order_data)
+        Order.objects.create(first_name='Иван', last_name='Петров', phonenumber='+79161234567', intake_id=intake_id)
+
+        with intake.intake_worker() as claim_dir:
+            intake.drain_batch(claim_dir, 10)
+
+        self.assertEqual(Order.objects.filter(intake_id=intake_id).count(), 1)
+        self.assertEqual(intake.get_intake_status(intake_id)['status'], intake.CREATED)
+
+    def test_broken_file_goes_to_failed(self):
+        with open(os.path.join(intake.get_intake_dir('pending'), '00000000000000000000broken.json'), 'w') as broken:
+            broken.write('{not json')
+        intake_id = intake.enqueue_order(self.order_data)
+
+        with intake.intake_worker() as claim_dir:
+            self.assertEqual(intake.drain_batch(claim_dir, 10), 2)
+
+        failed_dir = intake.get_intake_dir('failed')
+        self.assertEqual(sorted(os.listdir(failed_dir)), [
+            '00000000000000000000broken.error',
+            '00000000000000000000broken.json',
+        ])
+        with open(os.path.join(failed_dir, '00000000000000000000broken.error')) as error_file:
+            self.assertIn('error', json.load(error_file))
+        self.assertEqual(intake.get_intake_status(intake_id)['status'], intake.CREATED)
+
+    def test_failed_batch_is_logged_and_saved_one_by_one(self):
+        existing_order = Order.objects.create(
+            first_name='Иван', last_name='Петров', phonenumber='+79161234567', intake_id='second',
+        )
+        serializer = OrderSerializer(data=self.order_data)
+        serializer.is_valid(raise_exception=True)
+        entries = [
+            (intake_id, {**serializer.validated_data, 'intake_id': intake_id})
+            for intake_id in ['first', 'second']
+        ]
+
+        with self.assertLogs('foodcartapp.intake', level='ERROR') as logs:
+            outcomes = intake.create_orders(entries)
+
+        self.assertIn('Traceback', logs.output[0])
+        self.assertEqual(outcomes, {
+            'first': Order.objects.get(intake_id='first').id,
+            'second': existing_order.id,
+        })
+
+
+class KitchenFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.kitchen = Restaurant.objects.create(name='Кухня')
+        cls.other_kitchen = Restaurant.objects.create(name='Другая кухня')
+        cls.order = Order.objects.create(first_name='Иван', last_name='Петров', phonenumber='+79161234567')
+
+    def add_event(self, restaurant, event_id, age=0):
+        return OrderEvent.objects.create(
+            id=event_id,
+            order=self.order,
+            restaurant=restaurant,
+            kind=OrderEvent.ASSIGNED,
+            status=self.order.status,
+            created_at=timezone.now() - timedelta(seconds=age),
+        )
+
+    def test_other_restaurants_events_are_skipped_in_query(self):
+        self.add_event(self.other_kitchen, 1001)
+        own_event = self.add_event(self.kitchen, 1002)
+        self.add_event(self.other_kitchen, 1003)
+
+        events, settled_id = kitchen_feed.fetch_events(self.kitchen.id, 1000)
+
+        self.assertEqual(events, [own_event])
+        self.assertEqual(settled_id, 1003)
+
+    def test_events_behind_fresh_gap_are_held_back(self):
+        own_event = self.add_event(self.kitchen, 1001)
+        self.add_event(self.kitchen, 1003)
+
+        events, settled_id = kitchen_feed.fetch_events(self.kitchen.id, 1000)
+
+        self.assertEqual(events, [own_event])
+        self.assertEqual(settled_id, 1001)
+
+    def test_old_gap_is_taken_as_rolled_back(self):
+        self.add_event(self.other_kitchen, 1001, age=60)
+        late_event = self.add_event(self.kitchen, 1003, age=60)
+
+        events, settled_id = kitchen_feed.fetch_events(self.kitchen.id, 1000)
+
+        self.assertEqual(events, [late_event])
+        self.assertEqual(settled_id, 1003)
+
+    @override_settings(KITCHEN_FEED_POLL_INTERVAL=0)
+    def test_event_committed_below_last_id_after_snapshot_is_sent(self):
+        self.add_event(self.other_kitchen, 1000, age=60)
+        self.add_event(self.kitchen, 1001)
+        self.add_event(self.other_kitchen, 1003)
+        feed = kitchen_feed.iter_kitchen_feed(self.kitchen.id)
+        next(feed)  # retry interval
+
+        snapshot = next(feed)
+        late_event = self.add_event(self.kitchen, 1002)
+
+        self.assertTrue(snapshot.startswith('id: 1001\nevent: snapshot\n'))
+        self.assertTrue(next(feed).startswith(f'id: {late_event.id}\nevent: order\n'))
+        feed.close()
+
+    @override_settings(KITCHEN_FEED_MAX_CLIENTS=1)
+    @mock.patch.object(kitchen_feed, 'feed_slots', threading.BoundedSemaphore(1))
+    def test_worker_streams_limited_number_of_feeds(self):
+        first_feed = kitchen_feed.open_kitchen_feed(self.kitchen.id)
+        self.assertIsNone(kitchen_feed.open_kitchen_feed(self.kitchen.id))
+
+        first_feed.close()
+        second_feed = kitchen_feed.open_kitchen_feed(self.kitchen.id)
+        self.assertIsNotNone(second_feed)
+        second_feed.close()
+
+
+@override_settings(YANDEX_GEOCODER_API_KEY='test-key', GEOCODER_RETRY_INTERVAL=60 * 60)
+class GeocodingTests(TestCase):
+    def test_failed_lookup_is_remembered(self):
+        with mock.patch.object(utils, 'geocode', return_value=None) as geocode:
+            self.assertIsNone(utils.fetch_coordinates('Нигде, 1'))
+            self.assertIsNone(utils.fetch_coordinates('Нигде, 1'))
+
+        self.assertEqual(geocode.call_count, 1)
+        place = utils.Place.objects.get(address='Нигде, 1')
+        self.assertIsNone(place.latitude)
+
+    def test_bulk_lookup_leaves_geocoding_to_background(self):
+        utils.Place.objects.create(address='Москва, Тверская, 1', latitude=55.75, longitude=37.61)
+        utils.Place.objects.create(address='Нигде, 1')
+        stale_place = utils.Place.objects.create(address='Нигде, 2')
+        utils.Place.objects.filter(pk=stale_place.pk).update(updated_at=timezone.now() - timedelta(days=1))
+
+        with mock.patch.object(utils, 'geocode') as geocode, \
+                mock.patch.object(geocoding, 'submit_addresses') as submit_addresses, \
+                self.captureOnCommitCallbacks(execute=True):
+            coordinates = utils.fetch_coordinates_bulk(['Москва, Тверская, 1', 'Нигде, 1', 'Нигде, 2', 'Новый адрес'])
+
+        self.assertEqual(coordinates, {'Москва, Тверская, 1': (55.75, 37.61)})
+        geocode.assert_not_called()
+        submit_addresses.assert_called_once_with(['Нигде, 2', 'Новый адрес'])
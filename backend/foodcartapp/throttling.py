@@ -0,0 +1,196 @@
+"""Rate limiting and admission control for order placement.
+
+Token buckets live in a small SQLite file, so every gunicorn worker on the
+host sees the same counters. In-flight order inserts are capped with
+`flock` on a fixed set of slot files: a lock held by a worker that dies is
+released by the kernel, so slots never leak.
+"""
+import fcntl
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .phones import get_phonenumber_digits
+
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """Turn '5/min' into (bucket capacity, tokens per second)."""
+    if not rate:
+        return None
+    number, period = rate.split('/')
+    return int(number), int(number) / PERIODS[period[0]]
+
+
+class TokenBucketStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def get_connection(self):
+        # sqlite connections must not cross a fork, gunicorn forks workers
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if pid == os.getpid():
+            return connection
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS buckets '
+            '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS buckets_updated_at ON buckets (updated_at)')
+        self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def take(self, key, capacity, refill_rate):
+        """Take a token from the bucket, return seconds to wait if it is empty."""
+        connection = self.get_connection()
+        current_time = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            if row:
+                tokens, updated_at = row
+                tokens = min(capacity, tokens + (current_time - updated_at) * refill_rate)
+            else:
+                tokens = capacity
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = None
+            else:
+                wait = (1 - tokens) / refill_rate
+            connection.execute(
+                'INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                (key, tokens, current_time),
+            )
+            if random.random() < 0.01:
+                # buckets untouched for a day are full again, no need to keep them
+                connection.execute(
+                    'DELETE FROM buckets WHERE updated_at < ?',
+                    (current_time - PERIODS['d'],),
+                )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+
+buckets = TokenBucketStore(os.path.join(settings.ORDER_THROTTLE_DIR, 'buckets.sqlite3'))
+
+
+class OrderThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_rate(self):
+        return settings.ORDER_THROTTLE_RATES.get(self.scope)
+
+    def get_key(self, request):
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def allow_request(self, request, view):
+        rate = parse_rate(self.get_rate())
+        if rate is None:
+            return True
+        key = self.get_key(request)
+        if not key:
+            return True
+
+        capacity, refill_rate = rate
+        try:
+            self.wait_seconds = buckets.take(f'{self.scope}:{key}', capacity, refill_rate)
+        except sqlite3.OperationalError:
+            # the counters file stayed locked for the whole timeout, the host
+            # is overloaded: ask the client to come back instead of failing
+            logger.warning('Счётчики заказов заблокированы, запрос отклонён', exc_info=True)
+            self.wait_seconds = settings.ORDER_INSERT_RETRY_AFTER
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class OrderIPThrottle(OrderThrottle):
+    scope = 'ip'
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+
+class OrderPhoneThrottle(OrderThrottle):
+    scope = 'phone'
+
+    def get_key(self, request):
+        if not isinstance(request.data, dict) or not isinstance(request.data.get('phonenumber'), str):
+            return None
+        return get_phonenumber_digits(request.data['phonenumber'])
+
+
+@contextmanager
+def acquire_insert_slot():
+    """Yield True while holding one of the ORDER_MAX_CONCURRENT_INSERTS slots."""
+    os.makedirs(settings.ORDER_THROTTLE_DIR, exist_ok=True)
+    slot_numbers = list(range(settings.ORDER_MAX_CONCURRENT_INSERTS))
+    random.shuffle(slot_numbers)
+    for slot_number in slot_numbers:
+        slot_path = os.path.join(settings.ORDER_THROTTLE_DIR, f'insert-slot-{slot_number}.lock')
+        slot_fd = os.open(slot_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(slot_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(slot_fd)
+            continue
+        try:
+            yield True
+        finally:
+            fcntl.flock(slot_fd, fcntl.LOCK_UN)
+            os.close(slot_fd)
+        return
+    yield False
+
+
+def limit_concurrent_inserts(view):
+    """Answer 503 when all order insert slots on the host are busy.
+
+    Goes between @api_view and @transaction.atomic, so the slot is held
+    until the transaction commits.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.ORDER_MAX_CONCURRENT_INSERTS:
+            return view(request, *args, **kwargs)
+        with acquire_insert_slot() as acquired:
+            if acquired:
+                return view(request, *args, **kwargs)
+        retry_after = settings.ORDER_INSERT_RETRY_AFTER
+        return Response(
+            {'detail': f'Сервер перегружен. Повторите запрос через {retry_after} с.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(math.ceil(retry_after))},
+        )
+    return wrapper
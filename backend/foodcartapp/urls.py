@@ -1,12 +1,24 @@
 from django.urls import path
 
-from .views import product_list_api, banners_list_api, register_order
+from .views import (
+    banners_list_api,
+    order_intake_status_api,
+    product_list_api,
+    product_search_api,
+    register_order,
+    register_orders_batch,
+    restaurant_menu_api,
+)
 
 
 app_name = "foodcartapp"
 
 urlpatterns = [
     path('products/', product_list_api),
+    path('products/search/', product_search_api),
     path('banners/', banners_list_api),
+    path('restaurants/<int:restaurant_id>/menu/', restaurant_menu_api),
     path('order/', register_order),
+    path('order/status/<slug:intake_id>/', order_intake_status_api),
+    path('orders/batch/', register_orders_batch),
 ]
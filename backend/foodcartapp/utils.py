@@ -1,14 +1,12 @@
+from datetime import timedelta
+
 import requests
 from geopy.distance import distance as geopy_distance
 from django.conf import settings
+from django.utils import timezone
 from backend.places.models import Place
 
-def fetch_coordinates(address):
-    place, created = Place.objects.get_or_create(address=address)
-
-    if place.latitude and place.longitude:
-        return place.latitude, place.longitude
-
+def geocode(address):
     url = "https://geocode-maps.yandex.ru/1.x/"
     params = {
         "apikey": settings.YANDEX_GEOCODER_API_KEY,
@@ -17,18 +15,61 @@ def fetch_coordinates(address):
     }
 
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=settings.YANDEX_GEOCODER_TIMEOUT)
         response.raise_for_status()
         geo_data = response.json()
         geo_object = geo_data['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
         lon, lat = map(float, geo_object['Point']['pos'].split())
-        place.latitude = lat
-        place.longitude = lon
-        place.save()
         return lat, lon
     except (KeyError, IndexError, ValueError, requests.RequestException):
         return None
 
 
+def can_retry_geocoding(place):
+    """Whether a place without coordinates was last tried long enough ago."""
+    retry_before = timezone.now() - timedelta(seconds=settings.GEOCODER_RETRY_INTERVAL)
+    return place.updated_at < retry_before
+
+
+def fetch_coordinates(address):
+    place, created = Place.objects.get_or_create(address=address)
+
+    if place.latitude is not None and place.longitude is not None:
+        return place.latitude, place.longitude
+    if not created and not can_retry_geocoding(place):
+        return None
+
+    coords = geocode(address)
+    if coords:
+        place.latitude, place.longitude = coords
+    # a failed lookup is saved too, updated_at holds the time of the attempt
+    place.save()
+    return coords
+
+
+def fetch_coordinates_bulk(addresses):
+    """Return {address: (lat, lon)} for the addresses with known coordinates.
+
+    Known places are read with one query and nothing is geocoded here. New
+    addresses and the ones that failed more than GEOCODER_RETRY_INTERVAL
+    seconds ago are handed to the background geocoder.
+    """
+    from .geocoding import geocode_after_commit
+
+    addresses = list(dict.fromkeys(address for address in addresses if address))
+    places = {place.address: place for place in Place.objects.filter(address__in=addresses)}
+    coordinates = {
+        address: (place.latitude, place.longitude)
+        for address, place in places.items()
+        if place.latitude is not None and place.longitude is not None
+    }
+    geocode_after_commit(
+        address
+        for address in addresses
+        if address not in coordinates and (address not in places or can_retry_geocoding(places[address]))
+    )
+    return coordinates
+
+
 def get_distance_km(from_coords, to_coords):
     return round(geopy_distance(from_coords, to_coords).km, 2)
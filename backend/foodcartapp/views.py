@@ -1,71 +1,172 @@
-import json
-from django.http import JsonResponse
-from django.templatetags.static import static
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes, throttle_classes
 from rest_framework import status
 
 
+from .catalog import banners_snapshot, catalog_snapshot, dump_found_products, dump_products_page, menu_matrix
+from .idempotency import idempotent
+from .intake import QUEUED, enqueue_order, get_intake_status
 from .models import Product, Order, OrderItem
-from .serializers import OrderSerializer
+from .renderers import ORJSONRenderer
+from .serializers import OrderSerializer, ProductPageSerializer, ProductSearchSerializer, collect_product_ids
+from .throttling import OrderIPThrottle, OrderPhoneThrottle, limit_concurrent_inserts
+
+
+PRODUCT_PAGE_PARAMS = {'cursor', 'limit', 'category', 'special_status', 'fields'}
 
 
 def banners_list_api(request):
-    # FIXME move data to db?
-    return JsonResponse([
-        {
-            'title': 'Burger',
-            'src': static('burger.jpg'),
-            'text': 'Tasty Burger at your door step',
-        },
-        {
-            'title': 'Spices',
-            'src': static('food.jpg'),
-            'text': 'All Cuisines',
-        },
-        {
-            'title': 'New York',
-            'src': static('tasty.jpg'),
-            'text': 'Food is incomplete without a tasty dessert',
-        }
-    ], safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    snapshot = banners_snapshot.get()
+    max_age = settings.BANNERS_CACHE_MAX_AGE
+    if snapshot.expires_at:
+        seconds_left = (snapshot.expires_at - timezone.now()).total_seconds()
+        max_age = max(0, min(max_age, int(seconds_left)))
+
+    response = snapshot_response(request, snapshot)
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def snapshot_response(request, snapshot):
+    encoding = snapshot.get_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = snapshot.get_etag(encoding)
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=snapshot.last_modified,
+    )
+    if response is None:
+        response = HttpResponse(snapshot.get_body(encoding), content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(snapshot.last_modified)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
 
 
 def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(dumped_products, safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    if not PRODUCT_PAGE_PARAMS.intersection(request.GET):
+        return snapshot_response(request, catalog_snapshot.get())
+
+    serializer = ProductPageSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+    return HttpResponse(
+        dump_products_page(**serializer.validated_data),
+        content_type='application/json',
+    )
+
+
+def product_search_api(request):
+    serializer = ProductSearchSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
+        )
+    return HttpResponse(
+        dump_found_products(serializer.validated_data['q'], serializer.validated_data['limit']),
+        content_type='application/json',
+    )
+
+
+def restaurant_menu_api(request, restaurant_id):
+    snapshot = menu_matrix.get_menu(restaurant_id)
+    if snapshot is None:
+        return JsonResponse(
+            {'detail': 'Ресторан не найден'},
+            status=status.HTTP_404_NOT_FOUND,
+            json_dumps_params={'ensure_ascii': False},
+        )
+    return snapshot_response(request, snapshot)
+
 
-@transaction.atomic
 @api_view(['POST'])
+@renderer_classes([ORJSONRenderer])
+@throttle_classes([OrderIPThrottle, OrderPhoneThrottle])
+@limit_concurrent_inserts
+@idempotent
+@transaction.atomic
 def register_order(request):
     serializer = OrderSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
+    if settings.ORDER_INTAKE_ASYNC:
+        intake_id = enqueue_order(request.data)
+        return Response(
+            {'id': intake_id, 'status': QUEUED},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': request.build_absolute_uri(f'status/{intake_id}/')},
+        )
     order = serializer.save()
     return Response(OrderSerializer(order).data)
+
+
+@api_view(['GET'])
+@renderer_classes([ORJSONRenderer])
+def order_intake_status_api(request, intake_id):
+    intake_status = get_intake_status(intake_id)
+    if intake_status is None:
+        return Response({'detail': 'Заказ не найден'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(intake_status)
+
+
+@api_view(['POST'])
+@renderer_classes([ORJSONRenderer])
+@throttle_classes([OrderIPThrottle])
+@limit_concurrent_inserts
+@transaction.atomic
+def register_orders_batch(request):
+    orders_data = request.data
+    if not isinstance(orders_data, list) or not orders_data:
+        return Response(
+            {'detail': 'Ожидается непустой список заказов'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(orders_data) > settings.ORDER_BATCH_MAX_SIZE:
+        return Response(
+            {'detail': f'В пачке может быть не больше {settings.ORDER_BATCH_MAX_SIZE} заказов'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    items = [
+        item
+        for order_data in orders_data
+        if isinstance(order_data, dict) and isinstance(order_data.get('products'), list)
+        for item in order_data['products']
+    ]
+    context = {'products': Product.objects.in_bulk(collect_product_ids(items))}
+    results = []
+    valid_indexes = []
+    valid_orders_data = []
+    for index, order_data in enumerate(orders_data):
+        serializer = OrderSerializer(data=order_data, context=context)
+        if serializer.is_valid():
+            valid_indexes.append(index)
+            valid_orders_data.append(serializer.validated_data)
+        else:
+            results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+
+    orders = OrderSerializer(many=True).create(valid_orders_data) if valid_orders_data else []
+    for index, order in zip(valid_indexes, orders):
+        results.append({'index': index, 'status': 'created', 'id': order.id})
+    results.sort(key=lambda result: result['index'])
+
+    if not orders:
+        response_status = status.HTTP_400_BAD_REQUEST
+    elif len(orders) < len(orders_data):
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_201_CREATED
+    return Response({'results': results}, status=response_status)
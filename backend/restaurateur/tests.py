@@ -1,3 +1,153 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from backend.places.models import Place
+from foodcartapp.catalog import product_restaurants_index
+from foodcartapp.models import Order, OrderChange, OrderItem, Product, Restaurant, RestaurantMenuItem
+from foodcartapp.spatial import restaurant_locations
+
+from .views import describe_orders
+
+
+class OrderVersionTests(TestCase):
+    def test_fresh_gap_holds_back_later_versions(self):
+        first_version = OrderChange.take_version()
+        OrderChange.objects.create(id=first_version + 2)
+
+        self.assertEqual(OrderChange.get_current(gap_timeout=5), first_version)
+
+    def test_old_gap_is_taken_as_rolled_back(self):
+        first_version = OrderChange.take_version()
+        OrderChange.objects.create(id=first_version + 2, created_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(OrderChange.get_current(gap_timeout=5), first_version + 2)
+
+    def test_order_writes_take_increasing_versions(self):
+        order = Order.objects.create(first_name='Иван', last_name='Петров', phonenumber='+79161234567')
+        created_version = order.version
+
+        order.comment = 'Позвонить за час'
+        order.save()
+
+        self.assertGreater(order.version, created_version)
+        self.assertEqual(OrderChange.get_current(gap_timeout=5), order.version)
+
+
+class DescribeOrdersTests(TestCase):
+    def test_restaurant_name_is_escaped(self):
+        restaurant = Restaurant.objects.create(name='<img src=x onerror=alert(1)>')
+        order = Order.objects.create(
+            first_name='Иван',
+            last_name='Петров',
+            phonenumber='+79161234567',
+            cooking_restaurant=restaurant,
+        )
+
+        [order_item] = describe_orders(Order.objects.filter(pk=order.pk))
+
+        self.assertEqual(order_item['restaurants'], 'Готовит &lt;img src=x onerror=alert(1)&gt;')
+
+
+class NearestRestaurantsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        burger = Product.objects.create(name='Бургер', price=100, image='burger.png')
+        for number in range(7):
+            restaurant = Restaurant.objects.create(name=f'Ресторан {number}', address=f'Москва, Тверская, {number + 2}')
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=burger)
+            Place.objects.create(address=restaurant.address, latitude=55.76 + number / 100, longitude=37.61)
+        Place.objects.create(address='Москва, Тверская, 1', latitude=55.75, longitude=37.61)
+        cls.order = Order.objects.create(
+            first_name='Иван',
+            last_name='Петров',
+            phonenumber='+79161234567',
+            address='Москва, Тверская, 1',
+        )
+        OrderItem.objects.create(order=cls.order, product=burger, quantity=1, price=burger.price)
+
+    def setUp(self):
+        product_restaurants_index.invalidate()
+        restaurant_locations.invalidate()
+
+    def get_restaurants_text(self):
+        [order_item] = describe_orders(Order.objects.filter(pk=self.order.pk))
+        return order_item['restaurants']
+
+    @override_settings(DASHBOARD_NEAREST_RESTAURANTS=5)
+    def test_only_nearest_restaurants_are_shown(self):
+        restaurants_text = self.get_restaurants_text()
+
+        self.assertEqual(restaurants_text.count('<li>'), 5)
+        self.assertIn('Ресторан 4', restaurants_text)
+        self.assertNotIn('Ресторан 5', restaurants_text)
+
+    @override_settings(DASHBOARD_NEAREST_RESTAURANTS=0)
+    def test_zero_shows_all_restaurants(self):
+        self.assertEqual(self.get_restaurants_text().count('<li>'), 7)
+
+
+@override_settings(DASHBOARD_ORDERS_PAGE_SIZE=2)
+class OrdersApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', password='secret', is_staff=True)
+        cls.orders = [
+            Order.objects.create(
+                first_name='Иван',
+                last_name='Петров',
+                phonenumber='+79161234567',
+                payment_method=payment_method,
+                status=status,
+            )
+            for status, payment_method in [
+                (Order.NEW, Order.CASH),
+                (Order.DONE, Order.CASH),
+                (Order.COOKING, Order.ELECTRONIC),
+                (Order.NEW, Order.ELECTRONIC),
+                (Order.NEW, Order.CASH),
+            ]
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def get_orders(self, **params):
+        response = self.client.get(reverse('restaurateur:orders_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_ids(self, data):
+        return [order['id'] for order in data['orders']]
+
+    def test_pages_follow_cursor(self):
+        first_page = self.get_orders()
+        second_page = self.get_orders(before=first_page['next_before'])
+
+        self.assertEqual(self.get_ids(first_page), [self.orders[4].id, self.orders[3].id])
+        self.assertEqual(first_page['next_before'], self.orders[3].id)
+        self.assertEqual(self.get_ids(second_page), [self.orders[2].id, self.orders[0].id])
+        self.assertIsNone(second_page['next_before'])
+
+    def test_filters(self):
+        self.assertEqual(self.get_ids(self.get_orders(status=Order.DONE)), [self.orders[1].id])
+        self.assertEqual(
+            self.get_ids(self.get_orders(payment_method=Order.ELECTRONIC)),
+            [self.orders[3].id, self.orders[2].id],
+        )
+
+    def test_changes_are_limited_to_shown_page(self):
+        version = self.get_orders()['version']
+        for order in (self.orders[0], self.orders[3], self.orders[4]):
+            order.status = Order.DONE
+            order.save()
+        self.orders[2].comment = 'Без лука'
+        self.orders[2].save()
+
+        changes = self.get_orders(since=version, before=self.orders[4].id, next_before=self.orders[0].id)
+
+        self.assertEqual(self.get_ids(changes), [self.orders[2].id])
+        self.assertEqual(changes['removed'], [self.orders[3].id])
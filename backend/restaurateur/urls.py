@@ -11,9 +11,12 @@ urlpatterns = [
     path('products/', views.view_products, name="ProductsView"),
 
     path('restaurants/', views.view_restaurants, name="RestaurantView"),
+    path('restaurants/<int:restaurant_id>/kitchen/', views.view_kitchen, name="kitchen"),
+    path('restaurants/<int:restaurant_id>/kitchen/feed/', views.view_kitchen_feed, name="kitchen_feed"),
 
     # TODO заглушка для нереализованного функционала
     path('orders/', views.view_orders, name="view_orders"),
+    path('api/orders/', views.orders_api, name="orders_api"),
 
     path('login/', views.LoginView.as_view(), name="login"),
     path('logout/', views.LogoutView.as_view(), name="logout"),
@@ -1,15 +1,20 @@
 from django import forms
-from django.shortcuts import redirect, render
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.views import View
 from django.urls import reverse_lazy
+from django.utils.html import format_html, format_html_join
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 
 
-from foodcartapp.utils import fetch_coordinates, get_distance_km
-from foodcartapp.models import Product, Restaurant, Order, OrderItem, RestaurantMenuItem
-from backend.places.models import Place
+from foodcartapp.catalog import product_restaurants_index
+from foodcartapp.kitchen_feed import open_kitchen_feed
+from foodcartapp.spatial import restaurant_locations
+from foodcartapp.utils import fetch_coordinates_bulk
+from foodcartapp.models import Product, Restaurant, Order, OrderChange, OrderItem
 
 
 class Login(forms.Form):
@@ -92,62 +97,139 @@ def view_restaurants(request):
 
 
 @user_passes_test(is_manager, login_url='restaurateur:login')
-def view_orders(request):
-    menu_items = RestaurantMenuItem.objects.select_related('restaurant', 'product').filter(availability=True)
+def view_kitchen(request, restaurant_id):
+    return render(request, template_name="templates/kitchen.html", context={
+        'restaurant': get_object_or_404(Restaurant, pk=restaurant_id),
+        'retry_ms': settings.KITCHEN_FEED_RETRY_MS,
+    })
+
 
-    orders = (
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_kitchen_feed(request, restaurant_id):
+    restaurant = get_object_or_404(Restaurant, pk=restaurant_id)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+
+    feed = open_kitchen_feed(restaurant.id, last_event_id)
+    if feed is None:
+        response = HttpResponse('Слишком много подключений, повторите позже', status=503, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(max(1, settings.KITCHEN_FEED_RETRY_MS // 1000))
+        return response
+
+    response = StreamingHttpResponse(feed, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let nginx pass events through at once
+    return response
+
+
+class OrderFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', 'Все, кроме выполненных'), *Order.STATUS_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    payment_method = forms.ChoiceField(
+        label='Способ оплаты', required=False,
+        choices=[('', 'Любой'), *Order.PAYMENT_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    cooking_restaurant = forms.ModelChoiceField(
+        label='Ресторан', required=False,
+        queryset=Restaurant.objects.order_by('name'),
+        empty_label='Любой',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    created_from = forms.DateTimeField(
+        label='Оформлен с', required=False,
+        widget=forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M'),
+    )
+    created_to = forms.DateTimeField(
+        label='по', required=False,
+        widget=forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M'),
+    )
+    before = forms.IntegerField(min_value=1, required=False, widget=forms.HiddenInput)
+    # lower bound of the page for the change polls, exclusive
+    next_before = forms.IntegerField(min_value=1, required=False, widget=forms.HiddenInput)
+
+    def filter_orders(self, orders):
+        filters = self.cleaned_data
+        if filters['status']:
+            orders = orders.filter(status=filters['status'])
+        else:
+            orders = orders.unfinished()
+        if filters['payment_method']:
+            orders = orders.filter(payment_method=filters['payment_method'])
+        if filters['cooking_restaurant']:
+            orders = orders.filter(cooking_restaurant=filters['cooking_restaurant'])
+        if filters['created_from']:
+            orders = orders.filter(created_at__gte=filters['created_from'])
+        if filters['created_to']:
+            orders = orders.filter(created_at__lt=filters['created_to'])
+        return orders
+
+
+def get_dashboard_orders():
+    return (
         Order.objects
-        .with_total_price()
-        .exclude(status=Order.DONE)
-        .prefetch_related('items__product')
+        .prefetch_related('items')
         .select_related('cooking_restaurant')
         .order_by('-id')
     )
 
-    restaurant_coords = {}
-    for item in menu_items:
-        restaurant = item.restaurant
-        if restaurant.address not in restaurant_coords:
-            coords = fetch_coordinates(restaurant.address)
-            if coords:
-                restaurant_coords[restaurant.address] = coords
 
-    order_items = []
-    for order in orders:
-        order_place = Place.objects.filter(address=order.address).first()
-        if order_place and order_place.latitude and order_place.longitude:
-            order_coords = (order_place.latitude, order_place.longitude)
-        else:
-            order_coords = None
+def get_orders_page(orders, before=None):
+    """Return one page of orders ordered by -id and the cursor of the next one.
 
-        order_products = [item.product for item in order.items.all()]
+    The next page starts right below the last id of this one, so paging
+    deeper costs the same as the first page.
+    """
+    page_size = settings.DASHBOARD_ORDERS_PAGE_SIZE
+    if before is not None:
+        orders = orders.filter(id__lt=before)
+    orders = list(orders[:page_size + 1])
+    next_before = orders[page_size - 1].id if len(orders) > page_size else None
+    return orders[:page_size], next_before
 
-        product_restaurants = {}
-        for item in menu_items:
-            if item.product in order_products:
-                product_restaurants.setdefault(item.product, set()).add(item.restaurant)
 
-        if product_restaurants:
-            possible_restaurants = set.intersection(*product_restaurants.values())
-        else:
-            possible_restaurants = set()
+def describe_orders(orders):
+    orders = list(orders)
+    if not orders:
+        return []
+
+    candidates_index = product_restaurants_index.get()
+    locations = restaurant_locations.get()
+    coords_by_address = fetch_coordinates_bulk(order.address for order in orders)
+
+    order_items = []
+    for order in orders:
+        order_coords = coords_by_address.get(order.address)
+
+        possible_restaurants = {
+            restaurant.id: restaurant
+            for restaurant in candidates_index.get_restaurants({item.product_id for item in order.items.all()})
+        }
 
         restaurant_distances = []
-        if order_coords:
-            for restaurant in possible_restaurants:
-                coords = restaurant_coords.get(restaurant.address)
-                if coords:
-                    distance = get_distance_km(order_coords, coords)
-                    restaurant_distances.append((restaurant, distance))
-            restaurant_distances.sort(key=lambda x: x[1])
+        if order_coords and possible_restaurants:
+            nearest_restaurants = locations.nearest(
+                order_coords,
+                settings.DASHBOARD_NEAREST_RESTAURANTS or len(possible_restaurants),
+                accept=possible_restaurants.__contains__,
+            )
+            restaurant_distances = [
+                (possible_restaurants[restaurant_id], round(distance, 2))
+                for restaurant_id, distance in nearest_restaurants
+            ]
 
         if order.cooking_restaurant:
-            restaurant_text = f'Готовит {order.cooking_restaurant.name}'
+            restaurant_text = format_html('Готовит {}', order.cooking_restaurant.name)
         elif order_coords and restaurant_distances:
-            restaurant_text = (
-                '<details><summary>Может быть приготовлен ресторанами</summary><ul>' +
-                ''.join([f'<li>{r.name} — {d} км</li>' for r, d in restaurant_distances]) +
-                '</ul></details>'
+            restaurant_text = format_html(
+                '<details><summary>Может быть приготовлен ближайшими ресторанами</summary><ul>{}</ul></details>',
+                format_html_join(
+                    '', '<li>{} — {} км</li>',
+                    ((restaurant.name, distance) for restaurant, distance in restaurant_distances),
+                ),
             )
         elif not order_coords:
             restaurant_text = 'Ошибка определения координат'
@@ -156,16 +238,90 @@ def view_orders(request):
 
         order_items.append({
             'id': order.id,
+            'version': order.version,
+            'is_done': order.status == Order.DONE,
             'status': order.get_status_display(),
             'payment_method': order.get_payment_method_display(),
             'total_price': order.total_price,
             'client': f'{order.first_name} {order.last_name}',
-            'phonenumber': order.phonenumber,
+            'phonenumber': str(order.phonenumber),
             'address': order.address,
             'comment': order.comment,
             'restaurants': restaurant_text,
         })
 
+    return order_items
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_orders(request):
+    # the version is read before the orders, so the next poll can only
+    # repeat a change, never skip one
+    orders_version = OrderChange.get_current(settings.ORDER_VERSION_GAP_TIMEOUT)
+    order_filter = OrderFilter(request.GET)
+    orders, before, next_before = [], None, None
+    if order_filter.is_valid():
+        before = order_filter.cleaned_data['before']
+        orders, next_before = get_orders_page(order_filter.filter_orders(get_dashboard_orders()), before)
+
+    next_page_query = None
+    if next_before:
+        next_page_query = request.GET.copy()
+        next_page_query['before'] = next_before
+        next_page_query = next_page_query.urlencode()
+    first_page_query = request.GET.copy()
+    first_page_query.pop('before', None)
+
     return render(request, template_name='templates/order_items.html', context={
-        'order_items': order_items,
+        'order_items': describe_orders(orders),
+        'orders_version': orders_version,
+        'order_filter': order_filter,
+        'before': before,
+        'next_before': next_before,
+        'next_page_query': next_page_query,
+        'first_page_query': first_page_query.urlencode(),
+    })
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def orders_api(request):
+    since = request.GET.get('since', '')
+    if since and not since.isdigit():
+        return JsonResponse({'detail': 'since должен быть неотрицательным целым числом'}, status=400)
+    order_filter = OrderFilter(request.GET)
+    if not order_filter.is_valid():
+        return JsonResponse(order_filter.errors, status=400, json_dumps_params={'ensure_ascii': False})
+
+    orders_version = OrderChange.get_current(settings.ORDER_VERSION_GAP_TIMEOUT)
+    if not since:
+        orders, next_before = get_orders_page(
+            order_filter.filter_orders(get_dashboard_orders()),
+            order_filter.cleaned_data['before'],
+        )
+        return JsonResponse({
+            'version': orders_version,
+            'next_before': next_before,
+            'orders': describe_orders(orders),
+        })
+
+    # only the changes on the page the client shows are sent, changed
+    # orders that no longer match the filters are reported as removed
+    changed_orders = Order.objects.filter(version__gt=int(since))
+    if order_filter.cleaned_data['before']:
+        changed_orders = changed_orders.filter(id__lt=order_filter.cleaned_data['before'])
+    if order_filter.cleaned_data['next_before']:
+        changed_orders = changed_orders.filter(id__gt=order_filter.cleaned_data['next_before'])
+    orders = describe_orders(
+        order_filter.filter_orders(get_dashboard_orders().filter(id__in=changed_orders.values('id')))
+    )
+    removed_ids = (
+        changed_orders
+        .exclude(id__in=[order['id'] for order in orders])
+        .order_by('-id')
+        .values_list('id', flat=True)
+    )
+    return JsonResponse({
+        'version': orders_version,
+        'orders': orders,
+        'removed': list(removed_ids),
     })
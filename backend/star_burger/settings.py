@@ -1,4 +1,5 @@
 import os
+import tempfile
 import rollbar
 
 import dj_database_url
@@ -88,6 +89,48 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'star_burger.wsgi.application'
 YANDEX_GEOCODER_API_KEY = os.getenv('YANDEX_GEOCODER_API_KEY')
+YANDEX_GEOCODER_TIMEOUT = env.float('YANDEX_GEOCODER_TIMEOUT', default=5)
+GEOCODER_WORKERS = env.int('GEOCODER_WORKERS', default=2)
+GEOCODER_MAX_BACKLOG = env.int('GEOCODER_MAX_BACKLOG', default=500)
+GEOCODER_RETRY_INTERVAL = env.int('GEOCODER_RETRY_INTERVAL', default=60 * 60)
+RESTAURANT_LOCATIONS_RETRY_INTERVAL = env.int('RESTAURANT_LOCATIONS_RETRY_INTERVAL', default=5 * 60)
+DASHBOARD_NEAREST_RESTAURANTS = env.int('DASHBOARD_NEAREST_RESTAURANTS', default=5)
+DASHBOARD_ORDERS_PAGE_SIZE = env.int('DASHBOARD_ORDERS_PAGE_SIZE', default=50)
+ORDER_VERSION_GAP_TIMEOUT = env.int('ORDER_VERSION_GAP_TIMEOUT', default=5)
+
+BANNERS_CACHE_MAX_AGE = env.int('BANNERS_CACHE_MAX_AGE', default=300)
+ORDER_BATCH_MAX_SIZE = env.int('ORDER_BATCH_MAX_SIZE', default=100)
+
+ORDER_INTAKE_ASYNC = env.bool('ORDER_INTAKE_ASYNC', default=False)
+ORDER_INTAKE_DIR = env.str('ORDER_INTAKE_DIR', default=os.path.join(BASE_DIR, 'order_intake'))
+ORDER_INTAKE_RESULT_TTL = env.int('ORDER_INTAKE_RESULT_TTL', default=24 * 60 * 60)
+
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=24 * 60 * 60)
+IDEMPOTENCY_CACHE_SIZE = env.int('IDEMPOTENCY_CACHE_SIZE', default=10000)
+
+PHONENUMBER_CACHE_SIZE = env.int('PHONENUMBER_CACHE_SIZE', default=10000)
+
+KITCHEN_FEED_POLL_INTERVAL = env.float('KITCHEN_FEED_POLL_INTERVAL', default=1)
+KITCHEN_FEED_HEARTBEAT = env.int('KITCHEN_FEED_HEARTBEAT', default=15)
+KITCHEN_FEED_MAX_DURATION = env.int('KITCHEN_FEED_MAX_DURATION', default=5 * 60)
+KITCHEN_FEED_RETRY_MS = env.int('KITCHEN_FEED_RETRY_MS', default=2000)
+KITCHEN_FEED_GAP_TIMEOUT = env.int('KITCHEN_FEED_GAP_TIMEOUT', default=5)
+KITCHEN_FEED_MAX_CLIENTS = env.int('KITCHEN_FEED_MAX_CLIENTS', default=4)
+ORDER_EVENTS_TTL = env.int('ORDER_EVENTS_TTL', default=7 * 24 * 60 * 60)
+
+ORDER_THROTTLE_DIR = env.str('ORDER_THROTTLE_DIR', default=os.path.join(tempfile.gettempdir(), 'star_burger_throttle'))
+ORDER_THROTTLE_RATES = {
+    'ip': env.str('ORDER_THROTTLE_IP_RATE', default='30/min'),
+    'phone': env.str('ORDER_THROTTLE_PHONE_RATE', default='5/min'),
+}
+ORDER_MAX_CONCURRENT_INSERTS = env.int('ORDER_MAX_CONCURRENT_INSERTS', default=8)
+ORDER_INSERT_RETRY_AFTER = env.int('ORDER_INSERT_RETRY_AFTER', default=1)
+
+REST_FRAMEWORK = {
+    # client IP is taken from X-Forwarded-For behind this many proxies: the
+    # host nginx and the nginx of docker compose, see README
+    'NUM_PROXIES': env.int('NUM_PROXIES', default=2),
+}
 
 
 MEDIA_ROOT = os.path.join(BASE_DIR, '../../media')
@@ -97,6 +140,13 @@ DATABASES = {
     'default': dj_database_url.config(env='DATABASE_URL')
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env.str('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'star_burger_cache')),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',